@@ -0,0 +1,251 @@
+import numpy as np
+from config import load_plant
+from energy import charge_threshold
+import utils as u
+
+
+# Tugger train phases. Each phase is the next action the tugger train performs once its task endtime is reached
+DECIDE = 0   # At the warehouse: check the battery, (possibly) charge and travel to the first line
+TRAVEL = 1   # Travel from the previous line to line next_line
+LOAD = 2   # Pick up the unit loads at line next_line
+RETURN = 3   # Travel from the last line back to the warehouse
+UNLOAD = 4   # Unload at the warehouse
+
+
+class BatchFactoryModel:
+    """
+    NumPy version of FactoryModel running n_replications replications in lockstep.
+
+    The state of every replication is stored in arrays with one row per replication (R x lines, R x trains,
+    R x stations), and every replication keeps its own system time: at each iteration every replication jumps to the
+    first second in which one of its tugger trains reaches its task endtime, the lines and charging stations of
+    those replications are brought to that second in closed form, and the tugger trains acting in that second are
+    updated with masks, phase by phase. The iterations needed are therefore the events of the busiest replication,
+    not the seconds in which any replication has an event.
+    The tugger trains follow the same milk-run as Train (home warehouse, every line in order, home warehouse), so the
+    two backends give statistically equivalent results, but the replications are not identical to the ones of
+    FactoryModel with the same seed since the random numbers are drawn in a different order (python benchmark.py
+    --equivalence compares the two distributions).
+    Lines have deterministic cycle times (cycle_time_spread of the plant and the cycle_time_distribution of
+    FactoryModel are not supported).
+    """
+
+    def __init__(self, n_replications, tugger_train_number, tugger_train_capacity, ul_buffer, seed=None,
+                 energy_model=None, plant=None):
+        self.rng = np.random.default_rng(seed)
+        # See FactoryModel
+        self.plant = plant or load_plant()
+        self.energy_model = energy_model or self.plant.energy_model
+        self.n_replications = n_replications
+        self.tugger_train_number = tugger_train_number
+        self.tugger_train_capacity = tugger_train_capacity
+        n_lines = self.plant.n_lines
+        n_stations = self.plant.n_stations
+        if any(self.plant.cycle_time_spread):
+            raise ValueError("The batch backend only simulates deterministic cycle times (cycle_time_spread = 0)")
+        if len(ul_buffer) != n_lines:
+            raise ValueError("ul_buffer has " + str(len(ul_buffer)) + " buffer sizes, but the plant has "
+                             + str(n_lines) + " lines")
+
+        # System time reached by the whole batch, and by every replication, its lines and its charging stations
+        # (brought up to date lazily)
+        self.system_time = 0
+        self.time = np.zeros(n_replications, dtype=np.int64)
+        self.lines_time = np.zeros(n_replications, dtype=np.int64)
+        self.stations_time = np.zeros(n_replications, dtype=np.int64)
+
+        # Lines (see Line)
+        self.cycle_time = np.array(self.plant.cycle_times, dtype=float)
+        self.buffer_size = np.array(ul_buffer)
+        self.output_weight = np.array(self.plant.output_weight, dtype=float)
+        self.UL_in_buffer = np.zeros((n_replications, n_lines), dtype=int)
+        self.total_production = np.zeros((n_replications, n_lines), dtype=int)
+        self.idle_time = np.zeros((n_replications, n_lines))
+        self.count_time = np.zeros((n_replications, n_lines))
+        # Sum over every second of the idle time, needed for the average idle time used to find N
+        self.idle_time_area = np.zeros((n_replications, n_lines))
+
+        # Charging stations (see ChargingStation): end of the last reserved slot
+        self.free_at = np.zeros((n_replications, n_stations))
+        self.saturation_time = np.zeros((n_replications, n_stations))
+
+        # Tugger trains (see Train)
+        shape = (n_replications, tugger_train_number)
+        self.remaining_energy = self.plant.battery_size * self.rng.uniform(0.6, 1, shape)
+        self.load = np.zeros(shape, dtype=int)
+        self.weight = np.zeros(shape)
+        self.task_endtime = np.zeros(shape)
+        self.next_line = np.zeros(shape, dtype=int)
+        self.phase = np.full(shape, DECIDE)
+
+        # Quantities depending only on the layout
+        self.threshold = charge_threshold(self.plant.weight_capacity, self.plant.layout, self.energy_model)
+        self.layout = self.plant.layout
+        self.station_nodes = np.array([self.layout.station_node(s) for s in range(n_stations)])
+        # Home warehouse of every tugger train (see Train)
+        self.home = [self.layout.warehouse_node(train % self.layout.n_warehouses)
+                     for train in range(tugger_train_number)]
+
+    def advance(self, until):
+        # Brings every replication to the state FactoryModel.advance(until) would give
+        while True:
+            # Next second in which a tugger train of each replication acts
+            next_time = np.maximum(self.time + 1, np.ceil(self.task_endtime.min(axis=1)))
+            rows = np.nonzero(next_time <= until)[0]
+            if len(rows) == 0:
+                break
+            t = next_time[rows].astype(np.int64)
+            self.time[rows] = t
+            # In every second lines act before tugger trains, while charging stations act after them
+            self._advance_lines(rows, t)
+            self._advance_stations(rows, t - 1)
+            for train in range(self.tugger_train_number):
+                due = self.task_endtime[rows, train] <= t
+                if due.any():
+                    self._act(train, rows[due], t[due])
+        every = np.arange(self.n_replications)
+        self.time[:] = until
+        self._advance_lines(every, self.time)
+        self._advance_stations(every, self.time)
+        self.system_time = until
+
+    def _advance_lines(self, rows, time):
+        # Closed form of Line.advance_to for all the lines of the replications in rows, each one to its own time
+        ticks = (time - self.lines_time[rows])[:, None]
+        cycle, count, in_buffer = self.cycle_time, self.count_time[rows], self.UL_in_buffer[rows]
+        full = in_buffer >= self.buffer_size
+        to_completion = cycle - count
+        free_slots = self.buffer_size - in_buffer
+        # Seconds after which the buffer becomes full (0 if it is already full)
+        to_full = np.where(full, 0, to_completion + (free_slots - 1) * cycle)
+        fills = to_full <= ticks
+        produced = np.where(fills, np.where(full, 0, free_slots),
+                            np.where(ticks >= to_completion, 1 + (ticks - to_completion) // cycle, 0))
+        idle = np.where(fills, ticks - to_full, 0)
+        self.idle_time_area[rows] += ticks * self.idle_time[rows] + idle * (idle + 1) / 2
+        self.idle_time[rows] += idle
+        self.count_time[rows] = np.where(fills, np.where(full, count, 0),
+                                         np.where(produced > 0, (ticks - to_completion) % cycle, count + ticks))
+        self.UL_in_buffer[rows] = in_buffer + produced.astype(int)
+        self.total_production[rows] += produced.astype(int)
+        self.lines_time[rows] = time
+
+    def _advance_stations(self, rows, time):
+        # Closed form of ChargingStation.advance_to for all the stations of the replications in rows, each one to its
+        # own time. Slots are only booked after the stations have been brought to the previous second, so the last
+        # slot is the only one to account for
+        stations_time = self.stations_time[rows]
+        self.saturation_time[rows] += np.maximum(0, np.minimum(time[:, None], np.ceil(self.free_at[rows]) - 1)
+                                                 - stations_time[:, None])
+        self.stations_time[rows] = np.maximum(stations_time, time)
+
+    def _act(self, train, due, t):
+        # due: replications whose tugger train acts, t: their system time. Masks are computed before acting, so that
+        # each tugger train performs a single action per second
+        phase = self.phase[due, train]
+        masks = [(phase_id, phase == phase_id) for phase_id in (DECIDE, TRAVEL, LOAD, RETURN, UNLOAD)]
+        for phase_id, mask in masks:
+            rows = due[mask]
+            if len(rows) == 0:
+                continue
+            if phase_id == DECIDE:
+                self._decide(train, rows, t[mask])
+            elif phase_id == TRAVEL:
+                line = self.next_line[rows, train]
+                self._travel(train, rows, self.layout.line_node(line - 1), self.layout.line_node(line))
+                self.phase[rows, train] = LOAD
+            elif phase_id == LOAD:
+                self._load(train, rows)
+            elif phase_id == RETURN:
+                self._travel(train, rows, self.layout.line_node(self.next_line[rows, train]), self.home[train])
+                self.phase[rows, train] = UNLOAD
+            else:
+                self._unload(train, rows)
+
+    def _travel(self, train, rows, origin, destination):
+        # Same as Layout.travel_time and EnergyModel.travel in Train.move, with one random delay per leg
+        speed = u.compute_speed(self.weight[rows, train])
+        travel_time = (self.layout.distance[origin, destination] / speed + 8
+                       + self.rng.uniform(0, 1, len(rows)) * self.layout.max_delay[origin, destination])
+        self.task_endtime[rows, train] += travel_time
+        self.remaining_energy[rows, train] -= self.energy_model.travel(travel_time, self.weight[rows, train])
+
+    def _decide(self, train, rows, t):
+        # Train.check_charge, followed (if needed) by Train.charging, and by the travel to the first line (t: system
+        # time of every replication in rows)
+        origin = np.full(len(rows), self.home[train])
+        need_to_charge = self.remaining_energy[rows, train] < self.threshold
+        charging = rows[need_to_charge]
+        if len(charging):
+            # The station with the shortest waiting time is selected (the first one in case of ties), and its first
+            # free slot is booked
+            t = t[need_to_charge]
+            waiting_time = np.maximum(self.free_at[charging] - t[:, None], 0)
+            station = np.argmin(waiting_time, axis=1)
+            self.task_endtime[charging, train] += waiting_time[np.arange(len(charging)), station]
+            charging_time = self.plant.charging_curve.charging_time(self.remaining_energy[charging, train],
+                                                                    self.plant.battery_size)
+            self.remaining_energy[charging, train] = self.plant.battery_size
+            self.free_at[charging, station] = np.maximum(self.free_at[charging, station], t) + charging_time
+            self.task_endtime[charging, train] += charging_time
+            origin[need_to_charge] = self.station_nodes[station]
+        self.next_line[rows, train] = 0
+        self._travel(train, rows, origin, self.layout.line_node(0))
+        self.phase[rows, train] = LOAD
+
+    def _load(self, train, rows):
+        # Loading loop of Train.move: unit loads are picked up while there are some in the buffer and both the
+        # loading and weight capacity of the tugger train allow it
+        line = self.next_line[rows, train]
+        ul_weight = self.output_weight[line]
+        picked = np.zeros(len(rows), dtype=int)
+        for k in range(self.tugger_train_capacity):
+            picked += ((self.UL_in_buffer[rows, line] > picked)
+                       & (self.load[rows, train] + picked < self.tugger_train_capacity)
+                       & (self.weight[rows, train] + (picked + 1) * ul_weight <= self.plant.weight_capacity))
+        loading_times = self.rng.uniform(30, 60, (len(rows), self.tugger_train_capacity))
+        self.task_endtime[rows, train] += np.where(np.arange(self.tugger_train_capacity) < picked[:, None],
+                                                   loading_times, 0).sum(axis=1)
+        self.remaining_energy[rows, train] -= picked * self.energy_model.loading(ul_weight)
+        self.UL_in_buffer[rows, line] -= picked
+        self.load[rows, train] += picked
+        self.weight[rows, train] += picked * ul_weight
+
+        last = line >= len(self.cycle_time) - 1
+        self.phase[rows, train] = np.where(last, RETURN, TRAVEL)
+        self.next_line[rows, train] = np.where(last, line, line + 1)
+
+    def _unload(self, train, rows):
+        self.task_endtime[rows, train] += 30 + self.rng.uniform(30, 60, len(rows)) * self.load[rows, train]
+        self.remaining_energy[rows, train] -= self.energy_model.loading(self.weight[rows, train])
+        self.load[rows, train] = 0
+        self.weight[rows, train] = 0
+        self.next_line[rows, train] = 0
+        self.phase[rows, train] = DECIDE
+
+    def mean_idle_time(self):
+        """
+        Returns, for every replication, the average over every second of the idle time of the lines (see
+        factory.simulate_idle_time).
+
+        Return
+        -------
+        array mean idle time [s]
+        """
+        return self.idle_time_area.sum(axis=1) / (self.system_time * self.idle_time_area.shape[1])
+
+
+def simulate_idle_time_batch(seed, n_replications, tugger_train_number, tugger_train_capacity, ul_buffer, n_steps,
+                             plant=None):
+    """
+    Runs n_replications replications with BatchFactoryModel and returns their mean idle times (see
+    factory.simulate_idle_time).
+
+    Return
+    -------
+    list mean idle time [s]
+    """
+    model = BatchFactoryModel(n_replications, tugger_train_number, tugger_train_capacity, ul_buffer, seed=seed,
+                              plant=plant)
+    model.advance(n_steps)
+    return model.mean_idle_time().tolist()
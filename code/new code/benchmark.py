@@ -0,0 +1,353 @@
+import argparse
+import concurrent.futures
+import datetime
+import json
+import math
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+try:
+    import resource   # Not available on Windows: peak RSS is then not reported
+except ImportError:
+    resource = None
+from batch import simulate_idle_time_batch
+from config import Plant, load_plant
+from factory import simulate_idle_time
+from instrumentation import Instrumentation, run_replication
+import utils as u
+
+shift = int(7.5 * 3600)   # Simulated seconds in a shift
+
+# Reference scenarios: engine ("event", "tick" or "batch"), configuration, simulated time and replications, and
+# (agent engines only) dispatching policy of the tugger trains (see dispatching.py, default "fixed")
+scenarios = {
+    "default": dict(engine="event", tugger_train_number=4, tugger_train_capacity=4, ul_buffer=[3, 3, 3, 3, 3],
+                    n_steps=shift, replications=5),
+    "stressed": dict(engine="event", tugger_train_number=1, tugger_train_capacity=4, ul_buffer=[3, 3, 3, 3, 3],
+                     n_steps=shift, replications=5),
+    "large_fleet": dict(engine="event", tugger_train_number=12, tugger_train_capacity=6, ul_buffer=[3, 3, 3, 3, 3],
+                        n_steps=shift, replications=5),
+    "full_day": dict(engine="event", tugger_train_number=4, tugger_train_capacity=4, ul_buffer=[3, 3, 3, 3, 3],
+                     n_steps=2 * shift, replications=5),
+    "batch_1000": dict(engine="batch", tugger_train_number=4, tugger_train_capacity=4, ul_buffer=[3, 3, 3, 3, 3],
+                       n_steps=shift, replications=1000),
+    "skip_empty": dict(engine="event", tugger_train_number=4, tugger_train_capacity=4, ul_buffer=[3, 3, 3, 3, 3],
+                       n_steps=shift, replications=5, dispatching="skip_empty"),
+    "fullest_first": dict(engine="event", tugger_train_number=4, tugger_train_capacity=4, ul_buffer=[3, 3, 3, 3, 3],
+                          n_steps=shift, replications=5, dispatching="fullest_first"),
+    "nearest_vehicle": dict(engine="event", tugger_train_number=4, tugger_train_capacity=4,
+                            ul_buffer=[3, 3, 3, 3, 3], n_steps=shift, replications=5, dispatching="nearest_vehicle"),
+}
+
+# Scaling scenarios (benchmark.py --scaling): synthetic plants with a growing number of lines (see scaling_plant),
+# served by as many tugger trains as lines through the central dispatcher
+scaling_scenarios = {"scaling_" + str(size): dict(engine="event", lines=size, tugger_train_number=size,
+                                                  tugger_train_capacity=4, ul_buffer=[3] * size, n_steps=shift,
+                                                  replications=1, dispatching="nearest_vehicle")
+                     for size in (5, 10, 25, 50, 100, 200)}
+
+# Analysis, export and plotting libraries, which the simulation modules import only when they are used
+heavy_modules = ("pandas", "scipy", "matplotlib", "pyarrow")
+# Startup budgets: maximum time [s] to import each module in a new interpreter (as every worker process does
+# when processes are spawned) and the heavy libraries it must not import. mesa imports pandas, so the agent-based
+# modules are only required not to load scipy and matplotlib
+startup_budgets = {
+    "batch": dict(seconds=0.5, forbidden=heavy_modules),
+    "replications": dict(seconds=0.5, forbidden=heavy_modules),
+    "factory": dict(seconds=2.0, forbidden=("scipy", "matplotlib")),
+    "main": dict(seconds=2.5, forbidden=("scipy", "matplotlib")),
+}
+
+
+def peak_rss():
+    """
+    Returns the peak resident set size of the current process, or None where it is not available.
+
+    Return
+    -------
+    int peak RSS [MB]
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return round(rss / (2**20 if platform.system() == "Darwin" else 2**10), 1)
+
+
+def scaling_plant(n_lines, reference=None):
+    """
+    n_lines: lines of the plant, reference: Plant the synthetic plant is derived from (default: the one of the files
+    in the working directory)
+
+    Returns a synthetic plant with n_lines lines on a grid covering the area of the reference lines, with the cycle
+    times, unit load weights and delay factors of the reference lines in turn. The plant keeps the proportions of the reference
+    one (as many charging stations per line), with one warehouse every 50 lines.
+
+    Return
+    -------
+    Plant
+    """
+    reference = reference or load_plant()
+    columns = math.ceil(math.sqrt(n_lines))
+    rows = math.ceil(n_lines / columns)
+    x_min, x_max = min(reference.lines_x), max(reference.lines_x)
+    y_min, y_max = min(reference.lines_y), max(reference.lines_y)
+    lines_x = [x_min + (x_max - x_min) * (line % columns) / max(columns - 1, 1) for line in range(n_lines)]
+    lines_y = [y_min + (y_max - y_min) * (line // columns) / max(rows - 1, 1) for line in range(n_lines)]
+    cycle_times = [reference.cycle_times[line % reference.n_lines] for line in range(n_lines)]
+    output_weight = [reference.output_weight[line % reference.n_lines] for line in range(n_lines)]
+    delay_factors = [reference.delay_factors[line % reference.n_lines] for line in range(n_lines)]
+    # Charging stations along the same side as the reference ones, warehouses along the side of the reference one
+    n_stations = max(1, round(n_lines * reference.n_stations / reference.n_lines))
+    stations_y = [y_min + (y_max - y_min) * station / max(n_stations - 1, 1) for station in range(n_stations)]
+    n_warehouses = max(1, n_lines // 50)
+    warehouse_x, warehouse_y = reference.warehouses[0]
+    warehouses = [[warehouse_x + (x_max - warehouse_x) * warehouse / n_warehouses, warehouse_y]
+                  for warehouse in range(n_warehouses)]
+    return Plant(lines_x, lines_y, cycle_times, output_weight, reference.charging_phases, warehouses=warehouses,
+                 stations_x=[reference.stations_x[0]] * n_stations, stations_y=stations_y,
+                 battery_size=reference.battery_size,
+                 weight_capacity=reference.weight_capacity, energy_model=reference.energy_model,
+                 delay_factors=delay_factors)
+
+
+def agent_times(engine, tugger_train_number, tugger_train_capacity, ul_buffer, n_steps, seed=0, dispatching="fixed",
+                plant=None):
+    """
+    Runs one instrumented replication (see instrumentation.py) and returns the time spent in each agent type and
+    in the engine.
+
+    Return
+    -------
+    dict agent type -> time [s]
+    """
+    instrumentation = Instrumentation()
+    run_replication(tugger_train_number, tugger_train_capacity, ul_buffer, n_steps, seed,
+                    event_driven=engine != "tick", instrumentation=instrumentation, plant=plant,
+                    dispatching=dispatching)
+    measures = instrumentation.to_dict()
+    return dict(measures["agent_times"], Engine=measures["engine_time"])
+
+
+def run_scenario(name, seed=0):
+    """
+    Runs a reference scenario in the current process and returns its measures: simulated seconds per wall second,
+    replications per second, peak RSS, the mean idle time of the lines (to compare dispatching policies) and (not
+    for the batch engine) the time per agent type.
+
+    Return
+    -------
+    dict measures
+    """
+    scenario = scenarios[name] if name in scenarios else scaling_scenarios[name]
+    engine, replications, n_steps = scenario["engine"], scenario["replications"], scenario["n_steps"]
+    configuration = (scenario["tugger_train_number"], scenario["tugger_train_capacity"], scenario["ul_buffer"])
+    dispatching = scenario.get("dispatching", "fixed")
+    # Scaling scenarios run on a synthetic plant, the other ones on the plant of the files
+    plant = scaling_plant(scenario["lines"]) if "lines" in scenario else None
+    start = time.perf_counter()
+    if engine == "batch":
+        idle_times = simulate_idle_time_batch(seed, replications, *configuration, n_steps, plant=plant)
+    else:
+        idle_times = [simulate_idle_time(u.spawn_seed(seed, replication), *configuration, n_steps,
+                                         event_driven=engine == "event", plant=plant, dispatching=dispatching)
+                      for replication in range(replications)]
+    wall_time = time.perf_counter() - start
+    result = dict(scenario, wall_time=round(wall_time, 4),
+                  sim_seconds_per_wall_second=round(n_steps * replications / wall_time, 1),
+                  replications_per_second=round(replications / wall_time, 3),
+                  peak_rss_mb=peak_rss(),
+                  mean_idle_time=round(sum(idle_times) / len(idle_times), 2))
+    if engine != "batch":
+        result["agent_times"] = agent_times(engine, *configuration, n_steps, seed=seed, dispatching=dispatching,
+                                            plant=plant)
+    return result
+
+
+def run_benchmarks(names=None, seed=0):
+    """
+    Runs the reference scenarios (all of them by default) or the scaling scenarios given in names, each one in a
+    new process so that the peak RSS is the one of the scenario, and returns the results with the information
+    needed to compare runs.
+
+    Return
+    -------
+    dict results
+    """
+    names = names or list(scenarios)
+    results = {"timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+               "commit": git_commit(),
+               "python": platform.python_version(),
+               "platform": platform.platform(),
+               "scenarios": {}}
+    context = multiprocessing.get_context("spawn")
+    for name in names:
+        with concurrent.futures.ProcessPoolExecutor(1, mp_context=context) as executor:
+            results["scenarios"][name] = executor.submit(run_scenario, name, seed).result()
+        print_scenario(name, results["scenarios"][name])
+    return results
+
+
+def startup_time(module, repeat=3):
+    """
+    Imports module in repeat new interpreters.
+
+    Return
+    -------
+    tuple (best import time [s], heavy libraries imported)
+    """
+    code = ("import sys, time; start = time.perf_counter(); import " + module + "; "
+            "print(time.perf_counter() - start); print(*[name for name in " + repr(heavy_modules)
+            + " if name in sys.modules])")
+    times = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True).stdout.split("\n")
+        times.append(float(output[0]))
+    return min(times), output[1].split()
+
+
+def check_startup():
+    """
+    Measures the import time of the modules in startup_budgets and checks them against their budgets.
+
+    Return
+    -------
+    bool every module is within its budget
+    """
+    passed = True
+    for module, budget in startup_budgets.items():
+        seconds, imported = startup_time(module)
+        forbidden = [name for name in imported if name in budget["forbidden"]]
+        ok = seconds <= budget["seconds"] and not forbidden
+        passed = passed and ok
+        print(module, "-", "ok" if ok else "FAILED", "- import time [s]:", round(seconds, 3), "(budget",
+              str(budget["seconds"]) + ")", "- heavy libraries:", ", ".join(imported) or "none")
+        if forbidden:
+            print("   Forbidden libraries imported:", ", ".join(forbidden))
+    return passed
+
+
+def check_equivalence(batch_replications=1000, agent_replications=200, seed=0, alpha=0.01):
+    """
+    batch_replications, agent_replications: replications run with each backend, seed: seed of the check,
+    alpha: significance level of the tests
+
+    Runs the default scenario with the batch backend (BatchFactoryModel) and with the agent backend (FactoryModel,
+    event-driven) and compares the distributions of the mean idle time: the backends draw their random numbers in a
+    different order, so their replications differ, but their results must come from the same distribution.
+    The means are compared with Welch's t-test and the distributions with the two-sample Kolmogorov-Smirnov test.
+
+    Return
+    -------
+    bool neither test rejects the equivalence at level alpha
+    """
+    import scipy.stats   # Only needed by the check
+    scenario = scenarios["default"]
+    configuration = (scenario["tugger_train_number"], scenario["tugger_train_capacity"], scenario["ul_buffer"],
+                     scenario["n_steps"])
+    samples = {}
+    for backend, replications in (("batch", batch_replications), ("agent", agent_replications)):
+        start = time.perf_counter()
+        if backend == "batch":
+            samples[backend] = simulate_idle_time_batch(u.spawn_seed(seed, backend), replications, *configuration)
+        else:
+            samples[backend] = [simulate_idle_time(u.spawn_seed(seed, backend, replication), *configuration)
+                                for replication in range(replications)]
+        wall_time = time.perf_counter() - start
+        mean = sum(samples[backend]) / replications
+        deviation = (sum((x - mean) ** 2 for x in samples[backend]) / (replications - 1)) ** 0.5
+        print(backend, "backend -", replications, "replications in", round(wall_time, 2), "s (" +
+              str(round(replications / wall_time, 1)), "replications/s) - mean idle time [s]:", round(mean, 2),
+              "- standard deviation [s]:", round(deviation, 2))
+    t_test = scipy.stats.ttest_ind(samples["batch"], samples["agent"], equal_var=False)
+    ks_test = scipy.stats.ks_2samp(samples["batch"], samples["agent"])
+    passed = t_test.pvalue >= alpha and ks_test.pvalue >= alpha
+    print("Welch t-test p-value:", round(float(t_test.pvalue), 4), "- Kolmogorov-Smirnov p-value:",
+          round(float(ks_test.pvalue), 4), "-", "equivalent" if passed else "NOT EQUIVALENT",
+          "(alpha " + str(alpha) + ")")
+    return passed
+
+
+def git_commit():
+    # Commit of the benchmarked code, if it is in a git repository
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_scenario(name, result):
+    print(name, "-", result["engine"], "engine,", result["replications"], "replications")
+    print("   Wall time [s]:", result["wall_time"])
+    print("   Simulated seconds per wall second:", result["sim_seconds_per_wall_second"])
+    print("   Replications per second:", result["replications_per_second"])
+    print("   Peak RSS [MB]:", result["peak_rss_mb"])
+    print("   Mean idle time [s]:", result["mean_idle_time"])
+    for agent, seconds in result.get("agent_times", {}).items():
+        print("   " + agent, "time [s]:", seconds)
+
+
+def compare(old, new):
+    """
+    old, new: results of run_benchmarks
+
+    Prints, for every scenario in both results, the ratio between the new and the old throughput (> 1: faster).
+    """
+    print("Comparison of", new["commit"], "with", old["commit"])
+    for name, result in new["scenarios"].items():
+        if name in old["scenarios"]:
+            ratio = result["sim_seconds_per_wall_second"] / old["scenarios"][name]["sim_seconds_per_wall_second"]
+            print("  ", name, "speedup:", round(ratio, 2))
+
+
+def add_arguments(parser):
+    # Command line arguments of the benchmark (also used by the bench command of main.py)
+    parser.add_argument("scenarios", nargs="*", help="scenarios to run (default all): " + ", ".join(scenarios))
+    parser.add_argument("--output", default="./output/benchmarks/", help="directory of the JSON results")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare with")
+    parser.add_argument("--scaling", action="store_true", help="run the scaling scenarios instead: run time as lines "
+                                                               "and tugger trains grow from 5 to 200")
+    parser.add_argument("--startup", action="store_true", help="check the import times of the simulation modules "
+                                                               "against their budgets instead (exit status 1 if "
+                                                               "a budget is exceeded)")
+    parser.add_argument("--equivalence", action="store_true", help="check instead that the batch and agent "
+                                                                   "backends give the same distribution of the mean "
+                                                                   "idle time (exit status 1 if they do not)")
+
+
+def main(args):
+    """
+    args: parsed command line arguments (see add_arguments)
+
+    Runs the benchmarks, saves the results as JSON and compares them with a previous run if requested.
+    """
+    if args.startup:
+        sys.exit(0 if check_startup() else 1)
+    if args.equivalence:
+        sys.exit(0 if check_equivalence() else 1)
+    names = args.scenarios or (list(scaling_scenarios) if args.scaling else None)
+    unknown = set(names or ()) - set(scenarios) - set(scaling_scenarios)
+    if unknown:
+        sys.exit("Unknown scenarios: " + ", ".join(sorted(unknown)))
+    results = run_benchmarks(names)
+    os.makedirs(args.output, exist_ok=True)
+    file_name = os.path.join(args.output, ("scaling-" if args.scaling else "benchmark-")
+                             + results["timestamp"].replace(":", "") + "-"
+                             + str(results["commit"]) + ".json")
+    with open(file_name, "w") as f:
+        json.dump(results, f, indent=2)
+    print("Results saved to", file_name)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the simulation on the reference scenarios")
+    add_arguments(parser)
+    main(parser.parse_args())
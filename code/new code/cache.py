@@ -0,0 +1,130 @@
+import functools
+import hashlib
+import json
+import os
+import tempfile
+
+# Files whose content determines the results of a replication besides its parameters: the model source code
+source_files = [os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+                for name in ("factory.py", "layout.py", "energy.py", "charging.py", "batch.py", "gridsearch.py", "utils.py",
+                              "config.py", "dispatching.py")]
+
+
+@functools.lru_cache(maxsize=None)
+def source_fingerprint(files=tuple(source_files)):
+    """
+    Returns the hash of the model source code, so that results are not reused once the model changes. The plant
+    simulated is identified by its repr (see config.Plant), which holds its data, not by the files it was read from.
+
+    Return
+    -------
+    str hexadecimal digest
+    """
+    digest = hashlib.sha256()
+    for path in files:
+        digest.update(os.path.basename(path).encode())
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Persistent on-disk cache of replication results, addressed by the hash of everything determining them:
+    simulation function, parameters (seed included) and model source code. The plant is one of the parameters
+    (plant=config.Plant), hashed through its repr, which holds all its data: the simulations cached must receive
+    it explicitly rather than read the files of the working directory.
+    Each result is a JSON file; reading a result marks it as recently used, and evict removes the least recently
+    used results once the cache is larger than max_size bytes. With enabled=False the cache is bypassed.
+    """
+
+    def __init__(self, directory="./.cache", max_size=500 * 2**20, enabled=True):
+        self.directory = directory
+        self.max_size = max_size
+        self.enabled = enabled
+
+    def key(self, name: str, params):
+        content = json.dumps({"name": name, "params": params, "source": source_fingerprint()}, sort_keys=True,
+                             default=str)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def get(self, key):
+        """
+        Returns the cached result, or None if there is none.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "r") as f:
+                value = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        os.utime(path)
+        return value
+
+    def put(self, key, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written to a temporary file and renamed, so that parallel workers never read half-written results
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(value, f)
+        os.replace(tmp_path, path)
+
+    def evict(self):
+        """
+        Removes the least recently used results until the cache is smaller than max_size.
+        """
+        if not os.path.isdir(self.directory):
+            return
+        entries = []
+        for folder, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(folder, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+        size = sum(entry[1] for entry in entries)
+        for _, file_size, path in sorted(entries):
+            if size <= self.max_size:
+                break
+            os.remove(path)
+            size -= file_size
+
+    def clear(self):
+        """
+        Removes every cached result.
+        """
+        for folder, _, files in os.walk(self.directory):
+            for name in files:
+                os.remove(os.path.join(folder, name))
+
+    def wrap(self, simulate):
+        """
+        Returns simulate (a module-level function or a functools.partial of one) reading and writing its results
+        through the cache.
+        """
+        return CachedSimulation(simulate, self) if self.enabled else simulate
+
+
+class CachedSimulation:
+    """
+    Picklable wrapper of a simulation function returning cached results when available (see ResultCache.wrap).
+    """
+
+    def __init__(self, simulate, cache):
+        self.simulate = simulate
+        self.cache = cache
+        function = simulate.func if isinstance(simulate, functools.partial) else simulate
+        self.name = function.__module__ + "." + function.__qualname__
+        self.args = simulate.args if isinstance(simulate, functools.partial) else ()
+        self.keywords = simulate.keywords if isinstance(simulate, functools.partial) else {}
+
+    def __call__(self, *args):
+        key = self.cache.key(self.name, {"args": self.args + args, "keywords": self.keywords})
+        result = self.cache.get(key)
+        if result is None:
+            result = self.simulate(*args)
+            self.cache.put(key, result)
+        return result
@@ -1,28 +1,71 @@
+import numpy as np
+import utils as u
+
 path = "./charging.csv"
 
 
-def computeChargingTime(remaining_energy:float, tot_cap:float):
-    charge = dict()
-    with open(path, "r") as f:
-        f.seek(0)
-        for line in f.readlines()[1:]:
-            a = line.split(',') # The elements of the list a are strings, corresponding to the comma-separated values in the line
-            charge[float(a[0])] = int(a[1].replace("\n", ""))*60
-    for i in charge.keys():
-        if percentage<=i:
-            max_index = i
-            break
-        if percentage>=i:
-            min_index = i
+class ChargingCurve:
+    """
+    Charging curve of the tugger train batteries, built once from the charging phases (see u.read_charging_phases):
+    the time needed to charge an empty battery up to every state of charge, interpolated linearly between the
+    phases with np.interp (O(log n) per query). When the phases do not start from an empty battery (e.g. 7% after
+    5 minutes), the curve starts from the implicit phase (0%, 0 s), so that charging below the first phase is
+    interpolated from an empty battery.
+
+    Every method accepts floats or arrays (e.g. the remaining energies of many tugger trains at once). States of
+    charge outside [0, 1] are clamped.
+
+    charge: dict state of charge [0-1] -> time [s] needed to reach it from an empty battery
+    """
+
+    def __init__(self, charge):
+        charge = dict(sorted(charge.items()))
+        if next(iter(charge)) > 0:
+            charge = {0.0: 0, **charge}
+        self.levels = np.array(list(charge.keys()), dtype=float)
+        self.times = np.array(list(charge.values()), dtype=float)
+        self.full_time = self.times[-1]
+
+    @classmethod
+    def from_csv(cls, path=path):
+        return cls(u.read_charging_phases(path))
+
+    def elapsed(self, state_of_charge):
+        # Time needed to reach state_of_charge from an empty battery
+        return np.interp(np.clip(state_of_charge, 0, 1), self.levels, self.times)
+
+    def time_to_full(self, state_of_charge):
+        """
+        state_of_charge: charge of the battery [0-1]
+
+        Return
+        -------
+        time [s] needed to fully charge the battery
+        """
+        return self.full_time - self.elapsed(state_of_charge)
+
+    def state_after(self, state_of_charge, time):
+        """
+        state_of_charge: charge of the battery [0-1] when the charging begins, time: charging time [s]
+
+        Returns the state of charge after charging for time seconds, for partial (opportunity) charging.
 
-    upper_time = charge[max_index]
-    lower_time = charge[min_index]
+        Return
+        -------
+        state of charge [0-1]
+        """
+        return np.interp(self.elapsed(state_of_charge) + time, self.times, self.levels)
 
-    interpolated_time = lower_time*(max_index - percentage) + upper_time*(percentage - min_index)
-    interpolated_time = interpolated_time/(max_index - min_index)
-    time = charge[1] - upper_time
-    time += interpolated_time
-    return time
+    def charging_time(self, remaining_energy, battery_size):
+        """
+        remaining_energy: remaining energy [kWh], battery_size: battery size [kWh]
 
+        Returns the time needed to fully charge a battery with remaining_energy left (from the charging curve, an
+        empty or overdrawn battery charging from 0%).
 
-print(computeChargingTime(0.19))
\ No newline at end of file
+        Return
+        -------
+        time [s] needed to fully charge the battery
+        """
+        time = self.time_to_full(remaining_energy / battery_size)
+        return float(time) if np.ndim(time) == 0 else time
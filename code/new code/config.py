@@ -0,0 +1,260 @@
+import copy
+import functools
+import json
+import os
+try:
+    import tomllib
+except ImportError:   # Python < 3.11
+    import tomli as tomllib
+from charging import ChargingCurve
+from energy import EnergyModel
+from layout import Layout
+import utils as u
+
+
+class Plant:
+    """
+    Factory simulated by FactoryModel and BatchFactoryModel: layout, production lines, charging phases and tugger
+    train type. Every model receives its plant explicitly, so models of different plants can run in the same
+    process.
+
+    lines_x, lines_y, cycle_times [s], output_weight [kg]: line output points, as read by u.read_line_info,
+    charging_phases: dict as read by u.read_charging_phases, warehouses: list of [x, y] of the warehouse input
+    points (the tugger trains are assigned to them in turn), stations_x, stations_y: coordinates of the charging
+    stations, battery_size [kWh], weight_capacity: maximum weight [kg] carried by a tugger train, energy_model:
+    EnergyModel (default: constant consumption), delay_factors: maximum random delay [s] per metre travelled of the
+    legs to and from every line, from the delay column of the lines file (default: u.default_delay_factors),
+    cycle_time_spread: maximum relative deviation of the cycle times, drawn uniformly around the cycle time of the
+    line (see factory.uniform_cycle_time), one for all the lines or one per line (0: deterministic cycle times)
+    """
+
+    def __init__(self, lines_x, lines_y, cycle_times, output_weight, charging_phases, warehouses=((0, 80),),
+                 stations_x=(0, 0), stations_y=(10, 20), battery_size=4.8, weight_capacity=2000, energy_model=None,
+                 delay_factors=None, cycle_time_spread=0):
+        self.lines_x = list(lines_x)
+        self.lines_y = list(lines_y)
+        self.cycle_times = list(cycle_times)
+        self.output_weight = list(output_weight)
+        self.charging_phases = dict(charging_phases)
+        self.warehouses = [list(warehouse) for warehouse in warehouses]
+        self.stations_x = list(stations_x)
+        self.stations_y = list(stations_y)
+        self.battery_size = battery_size
+        self.weight_capacity = weight_capacity
+        self.energy_model = energy_model or EnergyModel()
+        self.delay_factors = [float(factor) for factor in (delay_factors if delay_factors is not None
+                                                           else u.default_delay_factors(len(self.lines_x)))]
+
+        if not isinstance(cycle_time_spread, (list, tuple)):
+            cycle_time_spread = [cycle_time_spread] * len(self.lines_x)
+        if len(cycle_time_spread) != len(self.lines_x):
+            raise ValueError("cycle_time_spread has " + str(len(cycle_time_spread)) + " spreads, but the plant has "
+                             + str(len(self.lines_x)) + " lines")
+        self.cycle_time_spread = [float(spread) for spread in cycle_time_spread]
+
+        # Distances and travel times between warehouse, lines and charging stations, computed once
+        self.layout = Layout(self.lines_x, self.lines_y, self.warehouses, self.stations_x, self.stations_y,
+                             self.delay_factors)
+        self.charging_curve = ChargingCurve(self.charging_phases)
+        self.n_warehouses = len(self.warehouses)
+        self.n_lines = len(self.lines_x)
+        self.n_stations = len(self.stations_x)
+
+    @classmethod
+    def from_files(cls, lines_path="./lines_info.csv", charging_path="./charging.csv", nodes_path=None, **kwargs):
+        """
+        nodes_path: file of the warehouses and charging stations (see u.read_nodes), replacing the warehouses,
+        stations_x and stations_y keyword arguments (None: use them)
+
+        Return
+        -------
+        Plant
+        """
+        lines_x, lines_y, cycle_times, output_weight, delay_factors = u.read_line_info(lines_path)
+        if delay_factors is not None:
+            kwargs["delay_factors"] = delay_factors
+        if nodes_path is not None:
+            kwargs["warehouses"], kwargs["stations_x"], kwargs["stations_y"] = u.read_nodes(nodes_path)
+        return cls(lines_x, lines_y, cycle_times, output_weight, u.read_charging_phases(charging_path), **kwargs)
+
+    def __repr__(self):
+        # Describes the whole plant, so that results cached per plant (see cache.py) are never mixed up
+        return "Plant(" + json.dumps({name: value for name, value in vars(self).items()
+                                      if name not in ("layout", "charging_curve")}, sort_keys=True, default=repr) + ")"
+
+
+@functools.lru_cache(maxsize=None)
+def load_plant(lines_path="./lines_info.csv", charging_path="./charging.csv", warehouses=((0, 80),), stations_x=(0, 0),
+               stations_y=(10, 20), battery_size=4.8, weight_capacity=2000, nodes_path=None, cycle_time_spread=0):
+    """
+    Returns the plant read from the files, read once per process and set of arguments (tuples, so that they can be
+    cached).
+
+    Return
+    -------
+    Plant
+    """
+    return Plant.from_files(lines_path, charging_path, nodes_path, warehouses=warehouses, stations_x=stations_x,
+                            stations_y=stations_y, battery_size=battery_size, weight_capacity=weight_capacity,
+                            cycle_time_spread=cycle_time_spread)
+
+
+class Config:
+    """
+    Settings of a run (see main.py). The defaults below are overridden by the settings of a scenario file
+    (TOML or YAML, whose tables/sections only group the settings) and then by keyword arguments.
+    TOML has no null value: a TOML scenario leaves out the settings whose default is None (n_workers, nodes_path)
+    to keep it, while YAML scenarios can write null and the command line none (see parse_setting).
+    """
+
+    defaults = {
+        # Simulation parameters
+        "n_shift": 2,   # Shifts per day
+        "wh": 7.5,   # Working Hours per shift
+        "seed": 42,
+        "event_driven": True,   # Jump from one event to the next instead of stepping the model every second
+        "backend": "agent",   # "agent" (FactoryModel) or "batch" (BatchFactoryModel, replications in lockstep)
+        "batch_size": 1000,   # Replications run together by the batch backend
+        "dispatching": "fixed",   # Routing of the tugger trains: fixed, skip_empty, fullest_first, nearest_vehicle
+        "common_random_numbers": False,   # Same random inputs in every configuration of sweep (variance reduction)
+        "antithetic": False,   # Replications in antithetic pairs (sweep, optimise, find-n; agent backend, no trace)
+
+        # Plant
+        "lines_path": "./lines_info.csv",   # Coordinates, cycle times, unit load weights (and delays) of the lines
+        "charging_path": "./charging.csv",   # Charging phases of the batteries
+        "warehouse_coord": [0, 80],   # x and y coordinates of the warehouse input point, or a list of them
+        "nodes_path": None,   # Warehouses and charging stations (kind,x,y), replacing their coordinates
+        "charging_stations_x": [0, 0],   # x coordinates of the charging stations
+        "charging_stations_y": [10, 20],   # y coordinates of the charging stations
+        "battery_size": 4.8,   # kWh
+        "weight_capacity": 2000,   # Maximum weight [kg] which can be carried by a tugger train
+        "cycle_time_spread": 0,   # Relative spread of the uniform cycle times, or a list per line (0: deterministic)
+
+        # Debug parameters (note that to have system time both verbose and system_time_on must be True)
+        "verbose": False,   # Run a verbose simulation
+        "system_time_on": False,   # Print system time
+        "instrument": False,   # Time the agent methods and count the events (simulate and traced sweep)
+        "log_file": "./output/simulation.log",   # Log of the run, and trace of the events when verbose
+        "log_level": "INFO",   # Minimum level of the logged records (DEBUG when verbose)
+
+        # Grid search (sweep)
+        "record_trace": False,   # Record the evolution of the system during the grid search (single process)
+        "grid_replications": 1,   # Replications of each combination of hyperparameters (record_trace = false)
+        "verboseSearch": False,   # Show each combination of hyperparameters
+
+        # Optimisation (optimise)
+        "idle_target": 300,   # Maximum idle time per shift of every line [s]
+        "tugger_cost": 1.0,   # Cost of a tugger train, relative to the ones of a wagon and of a buffer slot
+        "wagon_cost": 0.2,   # Cost of a wagon (one per unit load of tugger train capacity)
+        "buffer_cost": 0.05,   # Cost of a buffer slot of a line
+        "buffer_options": [1, 2, 3, 4, 5],   # Buffer sizes tried for every line
+        "initial_replications": 5,   # Replications of every configuration in the first round
+        "max_replications": 80,   # Replications of the configurations reaching the last round
+
+        # Find N (find-n)
+        "N": 5000,
+        "alpha": 0.05,
+        "precision": 0.0125,
+        "n_workers": None,   # Processes running the replications in parallel (None = one per core)
+        "sequential": True,   # Stop as soon as the half-width is below precision*mean (false: test N, N+500, ...)
+        "min_N": 30,   # Observations (replications, or antithetic pairs) before testing the sequential stopping rule
+        "max_N": 100000,   # Maximum number of replications of the sequential procedure
+
+        # Steady state (steady-state): one long run, warm-up truncation (MSER-5) and batch means
+        "steady_state_shifts": 100,   # Length of the long run [shifts]
+        "observation_interval": 60,   # Seconds between two observations of the KPIs
+        "n_batches": 20,   # Batches of the batch means (confidence level: 1 - alpha)
+
+        # Cache of replication results
+        "use_cache": True,   # Set to false to always simulate (bypass the cache)
+        "clear_cache": False,   # Remove every cached result before starting
+        "cache_size": 500,   # Maximum size of the cache [MB]
+
+        # Save output
+        "path": "./output/",
+        "export_df_to_csv": False,   # Export df with collected data to csv
+        "export_df_to_feather": False,   # Export df to feather format
+        "export_df_to_parquet": False,   # Stream the records to a Parquet dataset partitioned by hyperparameters
+        "parquet_chunk": 100000,   # Records kept in memory before being written to the Parquet dataset
+        "sample_interval": 1,   # Seconds between two records of the grid search
+        "record_only_changes": False,   # Record only when the state of the system changes
+
+        # Model hyperparameters: simulate and find-n use the first element of each list
+        "hyper_tugger_train_number": [4],
+        "hyper_ul_buffer": [[3, 3, 3, 3, 3]],
+        "hyper_tugger_train_capacity": [4],
+    }
+
+    def __init__(self, **settings):
+        unknown = set(settings) - set(self.defaults)
+        if unknown:
+            raise ValueError("Unknown settings: " + ", ".join(sorted(unknown)))
+        for name, value in self.defaults.items():
+            setattr(self, name, copy.deepcopy(settings.get(name, value)))
+
+    @classmethod
+    def from_file(cls, path, **overrides):
+        """
+        path: TOML (.toml) or YAML (.yml, .yaml) scenario file, overrides: settings replacing the ones of the file
+
+        Return
+        -------
+        Config
+        """
+        extension = os.path.splitext(path)[1].lower()
+        if extension == ".toml":
+            with open(path, "rb") as f:
+                data = tomllib.load(f)
+        elif extension in (".yml", ".yaml"):
+            import yaml   # Only needed for YAML scenarios
+            with open(path) as f:
+                data = yaml.safe_load(f) or {}
+        else:
+            raise ValueError("Scenario files must be .toml, .yml or .yaml: " + path)
+        settings = {}
+        for name, value in data.items():
+            # Tables (TOML) and mappings (YAML) which are not settings group settings
+            if isinstance(value, dict) and name not in cls.defaults:
+                settings.update(value)
+            else:
+                settings[name] = value
+        settings.update(overrides)
+        return cls(**settings)
+
+    @property
+    def n_steps(self):
+        # Simulated seconds
+        return int(self.n_shift * self.wh * 3600)
+
+    def plant(self):
+        # A single [x, y] pair or a list of them (several warehouses)
+        warehouses = self.warehouse_coord
+        if not isinstance(warehouses[0], (list, tuple)):
+            warehouses = [warehouses]
+        # A single spread or one per line
+        spread = self.cycle_time_spread
+        if isinstance(spread, list):
+            spread = tuple(spread)
+        return load_plant(self.lines_path, self.charging_path, tuple(tuple(warehouse) for warehouse in warehouses),
+                          tuple(self.charging_stations_x), tuple(self.charging_stations_y), self.battery_size,
+                          self.weight_capacity, self.nodes_path, spread)
+
+
+def parse_setting(assignment):
+    """
+    assignment: "name=value", with value written as in a TOML file (e.g. n_shift=1, hyper_ul_buffer=[[2,2,2,2,2]],
+    backend="batch"; strings may also be written without quotes), or none/null for None (e.g. n_workers=none to
+    use one process per core)
+
+    Return
+    -------
+    tuple (name, value)
+    """
+    name, _, value = assignment.partition("=")
+    if value.strip().lower() in ("none", "null"):
+        return name.strip(), None
+    try:
+        value = tomllib.loads("value = " + value)["value"]
+    except tomllib.TOMLDecodeError:
+        pass
+    return name.strip(), value
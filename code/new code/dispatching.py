@@ -0,0 +1,165 @@
+import math
+
+
+class DispatchingPolicy:
+    """
+    Dispatching policy of the tugger trains of a FactoryModel: it decides the first line of every tour, when a
+    tugger train leaves the warehouse (or a charging station), and the next stop after every line. One policy is
+    created per model (FactoryModel(..., dispatching=name), see policies), so it can keep the state of its model.
+
+    Subclasses redefine first_line and next_line. Policies returning None from first_line make the tugger train
+    wait at the warehouse until idle_until.
+
+    model: FactoryModel, created with its lines
+    """
+
+    # Longest wait [s] of a tugger train with nothing to pick up before asking the policy again
+    max_wait = 60
+
+    def __init__(self, model):
+        self.model = model
+        self.n_lines = len(model.lines)
+        self.output_weight = model.plant.output_weight
+
+    def first_line(self, train):
+        """
+        Return
+        -------
+        int index of the first line of the tour of train, or None to wait at the warehouse
+        """
+        raise NotImplementedError
+
+    def next_line(self, train):
+        """
+        Called once train has loaded at line train.next_line.
+
+        Return
+        -------
+        int index of the next line of the tour of train, or None to go back to the warehouse
+        """
+        raise NotImplementedError
+
+    def can_load(self, train, index):
+        # The line has a unit load waiting and the tugger train can carry it
+        return (self.model.line(index).UL_in_buffer >= 1 and train.load < train.capacity
+                and train.weight + self.output_weight[index] <= train.weight_capacity)
+
+    def idle_until(self, train):
+        """
+        Returns the time until which train waits when there is nothing to pick up: the next unit load completion
+        of any line, waiting at least one second and at most max_wait.
+
+        Return
+        -------
+        float time [s]
+        """
+        time = self.model.system_time
+        next_completion = min(self.model.line(index).next_completion for index in range(self.n_lines))
+        return min(max(next_completion, time + 1), time + self.max_wait)
+
+    def fallback_line(self, train):
+        # Line where a tugger train leaving a charging station goes when there is nothing to pick up: the one
+        # completing a unit load first
+        return min(range(self.n_lines), key=lambda index: self.model.line(index).next_completion)
+
+
+class FixedLoop(DispatchingPolicy):
+    """
+    Milk-run of the original model: every tour visits all the lines in order, whether or not their buffer has
+    unit loads, and goes back to the warehouse from the last line.
+    """
+
+    def first_line(self, train):
+        return 0
+
+    def next_line(self, train):
+        line = train.next_line + 1
+        return line if line < self.n_lines else None
+
+
+class SkipEmpty(DispatchingPolicy):
+    """
+    Milk-run visiting the lines in order, but only the ones with unit loads the tugger train can carry. The tugger
+    train goes back to the warehouse as soon as no further line can be served.
+    """
+
+    def first_line(self, train):
+        return self._next_from(train, 0)
+
+    def next_line(self, train):
+        return self._next_from(train, train.next_line + 1)
+
+    def _next_from(self, train, first):
+        for index in range(first, self.n_lines):
+            if self.can_load(train, index):
+                return index
+        return None
+
+
+class FullestFirst(DispatchingPolicy):
+    """
+    Demand-driven tours: the tugger train always goes to the line most at risk of stopping, i.e. the one whose
+    buffer is (or will be) full first (see Line.full_time), among the lines with unit loads it can carry and not
+    yet visited in the tour.
+    """
+
+    def __init__(self, model):
+        super().__init__(model)
+        # Lines visited in the current tour of every tugger train
+        self.visited = {}
+
+    def first_line(self, train):
+        self.visited[train.unique_id] = set()
+        return self._most_at_risk(train)
+
+    def next_line(self, train):
+        self.visited[train.unique_id].add(train.next_line)
+        return self._most_at_risk(train)
+
+    def _most_at_risk(self, train):
+        visited = self.visited[train.unique_id]
+        candidates = [index for index in range(self.n_lines)
+                      if index not in visited and self.can_load(train, index)]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda index: self.model.line(index).full_time())
+
+
+class NearestVehicle(DispatchingPolicy):
+    """
+    Central dispatcher: every tugger train which becomes free (at the warehouse, leaving a charging station or
+    after loading at a line) is assigned the nearest line with unit loads it can carry that is not already
+    assigned to another tugger train, the line most at risk first in case of ties. A line stays assigned until the
+    tugger train has loaded there, so two tugger trains never travel to the same unit loads.
+    """
+
+    def __init__(self, model):
+        super().__init__(model)
+        # Line index -> unique_id of the tugger train travelling to it
+        self.assigned = {}
+
+    def first_line(self, train):
+        return self._assign(train)
+
+    def next_line(self, train):
+        if self.assigned.get(train.next_line) == train.unique_id:
+            del self.assigned[train.next_line]
+        return self._assign(train)
+
+    def _assign(self, train):
+        distance = self.model.layout.distance[train.position]
+        best, best_key = None, (math.inf, math.inf)
+        for index in range(self.n_lines):
+            if index in self.assigned or not self.can_load(train, index):
+                continue
+            key = (distance[self.model.layout.line_node(index)], self.model.line(index).full_time())
+            if key < best_key:
+                best, best_key = index, key
+        if best is not None:
+            self.assigned[best] = train.unique_id
+        return best
+
+
+# Dispatching policies by name (FactoryModel dispatching, setting "dispatching" of config.Config)
+policies = {"fixed": FixedLoop, "skip_empty": SkipEmpty, "fullest_first": FullestFirst,
+            "nearest_vehicle": NearestVehicle}
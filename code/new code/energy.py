@@ -0,0 +1,107 @@
+import functools
+import numpy as np
+import utils as u
+
+
+class EnergyModel:
+    """
+    Energy consumption of a tugger train: a constant consumption while travelling (u.compute_energy) and the energy
+    needed to load and unload the unit loads (u.compute_energy_loading).
+
+    Energy models are compared and hashed by their parameters, so that the quantities precomputed for a vehicle
+    type (e.g. charge_threshold) are recomputed whenever the parameters change.
+    Subclasses redefine travel (and possibly loading) and params.
+
+    consumption: average consumption [kW]
+    """
+
+    def __init__(self, consumption=2.6):
+        self.consumption = consumption
+
+    def params(self):
+        return (self.consumption,)
+
+    def travel(self, time, weight):
+        """
+        time: travel time [s], weight: carried weight [kg] (floats or arrays)
+
+        Return
+        -------
+        energy consumed [kWh]
+        """
+        return u.compute_energy(time, consumption=self.consumption)
+
+    def loading(self, weight):
+        """
+        weight: weight [kg] loaded or unloaded (float or array)
+
+        Return
+        -------
+        energy consumed [kWh]
+        """
+        return u.compute_energy_loading(weight)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.params() == other.params()
+
+    def __hash__(self):
+        return hash((type(self).__name__, self.params()))
+
+    def __repr__(self):
+        return type(self).__name__ + repr(self.params())
+
+
+class WeightDependentEnergyModel(EnergyModel):
+    """
+    Energy model whose consumption while travelling depends on the carried weight, interpolating linearly a
+    consumption curve given by points (weight [kg], consumption [kW]).
+    """
+
+    def __init__(self, weights, consumptions):
+        super().__init__(consumption=None)
+        self.weights = tuple(weights)
+        self.consumptions = tuple(consumptions)
+        # Consumption per carried weight, computed once per weight class
+        self._consumption = {}
+
+    def params(self):
+        return self.weights, self.consumptions
+
+    def consumption_at(self, weight):
+        if np.ndim(weight):
+            return np.interp(weight, self.weights, self.consumptions)
+        consumption = self._consumption.get(weight)
+        if consumption is None:
+            consumption = float(np.interp(weight, self.weights, self.consumptions))
+            self._consumption[weight] = consumption
+        return consumption
+
+    def travel(self, time, weight):
+        return u.compute_energy(time, consumption=self.consumption_at(weight))
+
+
+@functools.lru_cache(maxsize=None)
+def charge_threshold(weight_capacity, layout, energy_model):
+    """
+    weight_capacity: maximum weight [kg] carried by the tugger train, layout: Layout, energy_model: EnergyModel
+
+    Returns the energy [kWh] needed to perform a pick-up tour fully loaded and to reach the charging station
+    afterwards, from the warehouse where this is the most (with several warehouses). A tugger train with less
+    energy than this goes to charge.
+    The threshold depends only on its arguments, so it is computed once per layout and vehicle type: layouts and
+    energy models are compared by value, so changing them gives a new threshold.
+
+    Return
+    -------
+    float energy [kWh]
+    """
+    # consumo per viaggare carico al massimo, consume per caricare e scaricare tutti i pallet,
+    loaded_times = layout.base_time(weight_capacity)
+    thresholds = []
+    for warehouse in range(layout.n_warehouses):
+        tour_time = sum(loaded_times[origin, destination] for origin, destination in layout.tour(warehouse))
+        # Reaching the first charging station empty, plus 190 s of manoeuvres
+        charger_time = 190 + layout.base_time(0)[layout.warehouse_node(warehouse), layout.station_node(0)]
+        thresholds.append(energy_model.travel(tour_time, weight_capacity) + energy_model.travel(charger_time, 0)
+                          + energy_model.loading(weight_capacity)*2)
+    return float(max(thresholds))
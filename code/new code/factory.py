@@ -0,0 +1,732 @@
+import collections
+import heapq
+import logging
+import math
+import random
+from mesa import Agent, Model
+from mesa.time import BaseScheduler
+from config import load_plant
+from dispatching import policies
+from energy import charge_threshold
+import utils as u
+
+# Events of the tugger trains, logged at DEBUG level by verbose models as "t=<system time> <agent> <event> <data>"
+logger = logging.getLogger(__name__)
+
+
+def uniform_cycle_time(rng, cycle_time, spread=0.1):
+    """
+    rng: random.Random, cycle_time: average cycle time [s] of the line, spread: maximum relative deviation
+
+    Cycle time distribution for FactoryModel (use functools.partial to change spread): uniform around the cycle
+    time of the line.
+
+    Return
+    -------
+    float cycle time [s]
+    """
+    return rng.uniform((1 - spread) * cycle_time, (1 + spread) * cycle_time)
+
+
+class Train(Agent):
+    def __init__(self, unique_id, model, index):
+        super().__init__(unique_id, model)
+        self.index = index   # Position in FactoryModel.trains
+        self.battery_size = self.model.plant.battery_size   # [kWh]
+
+        # Random inputs of the tugger train: initial battery charge, travel delays, loading and unloading times. With
+        # common random numbers each input has a stream of its own per tugger train, so that tugger train k draws
+        # the same numbers whatever the other tugger trains do, in every configuration simulated with the same
+        # seed. Otherwise they all come from the random stream of the model
+        if self.model.common_random_numbers:
+            self.battery_random, self.travel_random, self.handling_random = [
+                self.model.random_stream(None if self.model.trains_seed is None
+                                         else u.spawn_seed(self.model.trains_seed, purpose, index))
+                for purpose in ("battery", "travel", "handling")]
+        else:
+            self.battery_random = self.travel_random = self.handling_random = self.random
+
+        # initial battery charge is 60% and 100% of the maximum
+        self.remaining_energy = self.battery_size * self.battery_random.uniform(0.6, 1)   # [kWh]
+        self.capacity = self.model.tugger_train_capacity   # Maximum number of unit loads which can be loaded on a tugger train
+        self.load = 0   # Current load of the tugger train
+
+        # Distances and travel times of the plant
+        self.layout = self.model.plant.layout
+
+        # Warehouse where the tugger train starts and ends its tours (node of the layout): the tugger trains are
+        # assigned to the warehouses in turn
+        self.home = self.layout.warehouse_node(index % self.layout.n_warehouses)
+
+        # Current position of the tugger train (node of the layout). The starting position is the input/output point
+        # of its warehouse
+        self.position = self.home
+
+        # This attribute will be updated with the node of the next line/charging station/warehouse to be visited
+        self.next_stop = self.layout.line_node(0)
+
+        # Increased by a value equal to the task duration every time the tugger train completes a task
+        self.task_endtime = 0
+
+        # Id of the next line output point to be visited
+        self.next_line = 0
+
+        # This attribute will be True if the vehicle needs to charge
+        self.need_to_charge = False
+
+        # This attribute will be updated with the ID of the charging station where the vehicle is going to charge
+        self.selected_charging_station = None
+        self.weight_capacity = self.model.plant.weight_capacity
+        self.weight = 0
+
+        # Attribute to correct the functioning of the loading
+        self.flag_load = False
+
+        # Running totals for the KPIs (see FactoryModel.summary): time spent per activity [s], counted when each
+        # task begins, energy used [kWh] and number of charges
+        self.travel_time = 0
+        self.handling_time = 0
+        self.charging_time = 0
+        self.queue_time = 0
+        self.energy_used = 0
+        self.charges = 0
+
+    def check_charge(self):
+        # Function that checks if the vehicle battery level is enough to perform the following pick-up tour
+        if self.remaining_energy < self.charge_threshold():
+            # The charging station where the tugger train waits the least is selected
+            self.selected_charging_station = self.model.station_queue.earliest(self.model.system_time)
+            self.next_stop = self.layout.station_node(self.selected_charging_station)
+            self.need_to_charge = True
+            if self.model.verbose:
+                logger.debug("t=%d %s needs_charge remaining_energy=%.4f kWh station=%d distance=%.1f m",
+                             self.model.system_time, self.unique_id, self.remaining_energy,
+                             self.selected_charging_station, self.layout.distance[self.position, self.next_stop])
+            
+        else:
+            # The first line of the tour is chosen by the dispatching policy of the model (None: nothing to pick up)
+            line = self.model.dispatcher.first_line(self)
+            if line is None:
+                self.next_stop = None
+            else:
+                self.next_line = line
+                self.next_stop = self.layout.line_node(self.next_line)
+
+    def wait(self):
+        # Nothing to pick up: the tugger train waits at the warehouse
+        self.task_endtime = self.model.dispatcher.idle_until(self)
+        if self.model.verbose:
+            logger.debug("t=%d %s wait until=%.1f", self.model.system_time, self.unique_id, self.task_endtime)
+
+    def move(self):
+        if (not self.flag_load) or (self.next_stop == self.home and self.position != self.home):
+            distance_next_stop = self.layout.distance[self.position, self.next_stop]
+            if self.flag_load: 
+                if self.model.verbose:
+                    logger.debug("t=%d %s to_warehouse distance=%.1f m", self.model.system_time, self.unique_id,
+                                 distance_next_stop)
+
+            else:
+                if self.model.verbose:
+                    logger.debug("t=%d %s to_line line=%d distance=%.1f m weight=%s kg task_endtime=%.2f h",
+                                 self.model.system_time, self.unique_id, self.next_line, distance_next_stop,
+                                 self.weight, self.task_endtime / 3600)
+            # A single random delay per leg, so that the energy consumed matches the travel time
+            travel_time = self.layout.travel_time(self.position, self.next_stop, self.weight, self.travel_random)
+            energy = self.model.energy_model.travel(travel_time, self.weight)
+            self.task_endtime += travel_time
+            self.remaining_energy -= energy
+            self.travel_time += travel_time
+            self.energy_used += energy
+            self.position = self.next_stop
+            self.flag_load = True
+
+        else:
+            # If the next stop is not a charging station
+            if not self.need_to_charge:
+                # If the reached position is a line output point (and not the warehouse)
+                if self.position != self.home:
+                    line = self.model.line(self.next_line)
+                    ul_weight = self.model.plant.output_weight[self.next_line]
+                    # If there is at least one unit load at the line output point
+                    while line.UL_in_buffer >= 1:
+                        if self.load < self.capacity:
+                            if (self.weight + ul_weight) <= self.weight_capacity:
+                                if self.model.verbose:
+                                    logger.debug("t=%d %s pick line=%d task_endtime=%.2f h", self.model.system_time,
+                                                 self.unique_id, self.next_line, self.task_endtime/3600)
+
+                                # Loading time (between 30 seconds and 60 seconds)
+                                loading_time = self.handling_random.uniform(30, 60)
+                                energy = self.model.energy_model.loading(ul_weight)
+                                self.task_endtime += loading_time
+                                self.remaining_energy -= energy
+                                self.handling_time += loading_time
+                                self.energy_used += energy
+                                line.pick(self.model.system_time)
+                                self.load += 1
+                                self.weight += ul_weight
+                            else:
+                                if self.model.verbose:
+                                    logger.debug("t=%d %s weight_capacity_full line=%d", self.model.system_time,
+                                                 self.unique_id, self.next_line)
+                                break
+                        else:
+                            if self.model.verbose:
+                                logger.debug("t=%d %s loading_capacity_full line=%d", self.model.system_time,
+                                             self.unique_id, self.next_line)
+                            break
+                    else:
+                        if self.model.verbose:
+                            logger.debug("t=%d %s line_empty line=%d", self.model.system_time, self.unique_id,
+                                         self.next_line)
+                else:
+                    if self.model.verbose:
+                        logger.debug("t=%d %s unload load=%d", self.model.system_time, self.unique_id, self.load)
+                    unloading_time = 30 + self.handling_random.uniform(30, 60)*self.load
+                    energy = self.model.energy_model.loading(self.weight)
+                    self.task_endtime += unloading_time
+                    self.remaining_energy -= energy
+                    self.handling_time += unloading_time
+                    self.energy_used += energy
+                    self.load = 0
+                    self.weight = 0
+                    self.next_line = 0
+                    self.flag_load = False
+
+                if self.position != self.home:
+                    # The next line of the tour is chosen by the dispatching policy (None: back to the warehouse)
+                    line = self.model.dispatcher.next_line(self)
+                    if line is None:
+                        self.next_stop = self.home
+                    else:
+                        self.next_line = line
+                        self.next_stop = self.layout.line_node(self.next_line)
+                        self.flag_load = False
+
+            if self.model.verbose:
+                logger.debug("t=%d %s task_endtime=%.2f h weight=%s kg", self.model.system_time, self.unique_id,
+                             self.task_endtime/3600, self.weight)
+        
+    def charging(self):
+        # Function that simulates the (possible) queuing at the charging station and the battery charging:
+        # the tugger train books the first free slot of the station, waiting until it begins
+        # The battery is fully charged
+        charging_size = self.battery_size - self.remaining_energy
+        charging_time = self.model.plant.charging_curve.charging_time(self.remaining_energy, self.battery_size)  # seconds
+        start = self.model.station_queue.reserve(self.selected_charging_station, self.model.system_time,
+                                                 charging_time)
+        queue_time = start - self.model.system_time
+        self.task_endtime += queue_time
+        self.queue_time += queue_time
+        self.remaining_energy += charging_size
+        self.task_endtime += charging_time
+        self.charging_time += charging_time
+        self.charges += 1
+        if self.model.verbose:
+            logger.debug("t=%d %s charged task_endtime=%.2f h remaining_energy=%.4f kWh", self.model.system_time,
+                         self.unique_id, self.task_endtime/3600, self.remaining_energy)
+
+        self.need_to_charge = False
+        self.position = self.layout.station_node(self.selected_charging_station)
+        # From the charging station the tugger train goes to the first line of its tour
+        line = self.model.dispatcher.first_line(self)
+        self.next_line = line if line is not None else self.model.dispatcher.fallback_line(self)
+        self.next_stop = self.layout.line_node(self.next_line)
+
+    def charge_threshold(self):
+        return charge_threshold(self.weight_capacity, self.layout, self.model.energy_model)
+    
+    def step(self):
+        if self.task_endtime <= self.model.system_time:
+            if self.position == self.home and self.flag_load == False:
+                self.check_charge()
+            if self.need_to_charge:
+                self.charging()
+                self.move()
+            elif self.next_stop is None:
+                self.wait()
+            else:
+                self.move()
+
+
+class ChargingStation(Agent):
+    def __init__(self, unique_id, model):
+        super().__init__(unique_id, model)
+        # Reservation timeline of the station: the slots (start, end) booked by the tugger trains and not yet
+        # accounted for, in time order, and the time at which the last one ends. A tugger train arriving at time t
+        # waits max(0, free_at - t) before charging. The timeline changes only when a tugger train books a slot
+        self.reservations = collections.deque()
+        self.free_at = 0
+        self.is_charging = False
+
+        # Seconds during which the station has been charging a tugger train, up to last_update (see advance_to)
+        self.saturation_time = 0
+
+        # System time up to which the saturation has been accounted for (see advance_to)
+        self.last_update = 0
+
+    def waiting_time_at(self, time):
+        # Time that a tugger train arriving at time must wait before beginning its charging process at this station
+        return max(0, self.free_at - time)
+
+    def reserve(self, time, duration):
+        """
+        time: booking time, duration: charging time [s]
+
+        Books the first free slot of duration seconds from time on (use StationQueue.reserve to keep the queue of
+        the model up to date).
+
+        Return
+        -------
+        float start of the slot
+        """
+        start = max(self.free_at, time)
+        self.free_at = start + duration
+        self.reservations.append((start, self.free_at))
+        return start
+
+    def step(self):
+        # Step duration: 1 second
+        self.advance_to(self.model.system_time)
+
+    def advance_to(self, time):
+        # Accounts for the saturation up to time (included): the station is charging in the seconds s with
+        # ceil(start) <= s < ceil(end) of a slot. The slots ending by time are dropped
+        if time <= self.last_update:
+            return
+        reservations = self.reservations
+        for start, end in reservations:
+            first, last = math.ceil(start), min(math.ceil(end) - 1, time)
+            if first > time:
+                break
+            self.saturation_time += max(0, last - max(first - 1, self.last_update))
+        while reservations and math.ceil(reservations[0][1]) - 1 <= time:
+            reservations.popleft()
+        self.is_charging = self.free_at > time
+        self.last_update = time
+
+
+class StationQueue:
+    """
+    Charging stations of a model ordered by availability: earliest returns the station where a tugger train
+    arriving at a given time waits the least (the first one among the free stations, or the one becoming free
+    first) in O(log S) amortised time, S being the number of stations.
+
+    Free stations are kept in a heap of indices, busy ones in a heap of (free_at, index). Entries are moved from
+    the busy heap to the free heap as time goes by, and entries made obsolete by a new booking are skipped.
+    """
+
+    def __init__(self, stations):
+        self.stations = stations
+        self.free = list(range(len(stations)))
+        self.busy = []
+        self.is_free = [True] * len(stations)
+
+    def earliest(self, time):
+        """
+        Return
+        -------
+        int index of the station
+        """
+        free, busy, stations = self.free, self.busy, self.stations
+        while busy and (busy[0][0] <= time or busy[0][0] != stations[busy[0][1]].free_at):
+            free_at, index = heapq.heappop(busy)
+            if free_at == stations[index].free_at and not self.is_free[index]:
+                self.is_free[index] = True
+                heapq.heappush(free, index)
+        while free and not self.is_free[free[0]]:
+            heapq.heappop(free)
+        return free[0] if free else busy[0][1]
+
+    def reserve(self, index, time, duration):
+        """
+        Books a slot of duration seconds at station index from time on (see ChargingStation.reserve).
+
+        Return
+        -------
+        float start of the slot
+        """
+        station = self.stations[index]
+        start = station.reserve(time, duration)
+        self.is_free[index] = False
+        heapq.heappush(self.busy, (station.free_at, index))
+        return start
+
+
+class Line(Agent):
+    def __init__(self, unique_id, model, index):
+        super().__init__(unique_id, model)
+
+        # Index of the line in the plant and in FactoryModel.lines
+        self.line_index = index
+
+        # Production time of one unit load (seconds), and maximum relative deviation of the cycles drawn around it
+        # (0: every cycle lasts cycle_time, see config.Plant)
+        self.cycle_time = self.model.plant.cycle_times[self.line_index]
+        self.cycle_time_spread = self.model.plant.cycle_time_spread[self.line_index]
+
+        # Maximum number of unit Loads in the buffer at the line output point
+        self.buffer_size = self.model.ul_buffer[self.line_index]
+
+        # Actual number of unit loads in the buffer at the line output point.
+        # The buffer is empty at the beginning of the simulation
+        self.UL_in_buffer = 0
+
+        # Overall number of unit loads produced by the line
+        self.total_production = 0
+
+        # Time (seconds) during which the station is not producing since the buffer is full
+        self.idle_time = 0
+
+        # Random stream of the cycle times of this line: each line has its own, so that the cycles drawn do not
+        # depend on how often the lines are brought up to date (every second or only at the events)
+        self.cycle_random = self.model.random_stream(None if self.model.lines_seed is None
+                                                     else u.spawn_seed(self.model.lines_seed, self.line_index))
+
+        # Production is computed analytically, from one unit load completion to the next (see advance_to).
+        # Time at which the unit load in production is completed (inf while the buffer is full)
+        self.next_completion = self.draw_cycle_time()
+        # Time at which the buffer became full (None if it is not full)
+        self.blocked_since = None
+
+        # System time up to which the line has been brought (see advance_to)
+        self.last_update = 0
+
+        # Running totals for the time-weighted KPIs (see FactoryModel.summary), updated by advance_to:
+        # integral of the unit loads in the buffer over time [UL*s] and sum over every second of the idle time [s]
+        self.buffer_area = 0
+        self.idle_time_area = 0
+
+    def draw_cycle_time(self):
+        # Duration of the next production cycle: a draw from the cycle time distribution of the model, or from the
+        # uniform distribution of the spread of the line, or the cycle time. The draws are taken from the random
+        # stream of the line so that the draws of the tugger trains are not affected
+        if self.model.cycle_time_distribution is not None:
+            return self.model.cycle_time_distribution(self.cycle_random, self.cycle_time)
+        if self.cycle_time_spread:
+            return uniform_cycle_time(self.cycle_random, self.cycle_time, self.cycle_time_spread)
+        return self.cycle_time
+
+    def step(self):
+        # Step duration: 1 second
+        self.advance_to(self.model.system_time)
+
+    def advance_to(self, time):
+        # Brings the line to time, producing every unit load completed up to time (included) and accumulating the
+        # idle time while the buffer is full
+        if time <= self.last_update:
+            return
+        self.buffer_area += self.UL_in_buffer * (time - self.last_update)
+        self.idle_time_area += self.idle_time * (time - self.last_update)
+        while self.next_completion <= time:
+            self.total_production += 1
+            self.UL_in_buffer += 1
+            self.buffer_area += time - self.next_completion
+            if self.UL_in_buffer >= self.buffer_size:
+                # The buffer stays full until a tugger train picks up a unit load
+                self.blocked_since = self.next_completion
+                self.next_completion = math.inf
+            else:
+                self.next_completion += self.draw_cycle_time()
+        if self.blocked_since is not None:
+            idle_since = max(self.blocked_since, self.last_update)
+            self.idle_time += time - idle_since
+            # The idle time grows by s - idle_since in every second s after idle_since
+            first = math.floor(idle_since) + 1
+            self.idle_time_area += (time - first + 1) * ((first + time) / 2 - idle_since)
+        self.last_update = time
+
+    def pick(self, time):
+        # A unit load is picked up at time (the line must have been brought to time): if the buffer was full,
+        # production restarts
+        self.UL_in_buffer -= 1
+        if self.blocked_since is not None:
+            self.blocked_since = None
+            self.next_completion = time + self.draw_cycle_time()
+
+    def full_time(self):
+        """
+        Returns the time at which the buffer becomes full if no unit load is picked up (with stochastic cycle times,
+        assuming every remaining cycle lasts the average cycle time).
+
+        Return
+        -------
+        float time [s]
+        """
+        if self.blocked_since is not None:
+            return self.blocked_since
+        return self.next_completion + (self.buffer_size - self.UL_in_buffer - 1) * self.cycle_time
+
+    def idle_time_at(self, time):
+        """
+        Returns the idle time the line will have at time (not before the last update) if no unit load is picked up,
+        without changing the line.
+
+        Return
+        -------
+        float idle time [s]
+        """
+        return self.idle_time + max(0, time - max(self.full_time(), self.last_update))
+
+
+class FactoryModel(Model):
+    def __init__(self, tugger_train_number, tugger_train_capacity, ul_buffer, seed=None, verbose=False,
+                 system_time_on=False, energy_model=None, cycle_time_distribution=None, instrumentation=None,
+                 plant=None, dispatching="fixed", common_random_numbers=False, antithetic=False):
+        super().__init__()
+        self.tugger_train_number = tugger_train_number
+        self.tugger_train_capacity = tugger_train_capacity
+        self.ul_buffer = ul_buffer
+        # Layout, lines, charging phases and tugger train type (see config.Plant), by default read from
+        # ./lines_info.csv and ./charging.csv
+        self.plant = plant or load_plant()
+        self.layout = self.plant.layout
+        if len(ul_buffer) != self.plant.n_lines:
+            raise ValueError("ul_buffer has " + str(len(ul_buffer)) + " buffer sizes, but the plant has "
+                             + str(self.plant.n_lines) + " lines")
+        # Energy consumption of the tugger trains (see energy.py), by default the one of the plant
+        self.energy_model = energy_model or self.plant.energy_model
+        # Cycle times of the lines: None for the cycle time spreads of the plant (cycle_time_spread setting), or a
+        # function (rng, cycle time) returning the duration of a cycle for every line (e.g.
+        # functools.partial(uniform_cycle_time, spread=0.1)), drawn from random streams of their own
+        self.cycle_time_distribution = cycle_time_distribution
+        self.lines_seed = None if seed is None else u.spawn_seed(seed, "lines")
+
+        # self.random, created by mesa from seed, is the random stream of the model: the agents draw from it through
+        # their own self.random, so that replications with the same seed are identical.
+        # Variance reduction: with common_random_numbers the tugger trains draw from streams of their own (see
+        # Train), so that configurations simulated with the same seed share their random inputs. An antithetic model
+        # draws 1 - U wherever the model with the same seed draws U (see u.AntitheticRandom)
+        self.common_random_numbers = common_random_numbers
+        self.antithetic = antithetic
+        self.trains_seed = None if seed is None else u.spawn_seed(seed, "trains")
+        if antithetic:
+            self.random = self.random_stream(seed)
+
+        # Debug parameters (note that to have system time both verbose and system_time_on must be True).
+        # The events are logged (see u.configure_logging): verbose is turned off when the DEBUG records of this
+        # module would be discarded, so that a quiet model does not even format them
+        self.verbose = verbose and logger.isEnabledFor(logging.DEBUG)
+        self.system_time_on = system_time_on
+
+        self.schedule_trains = BaseScheduler(self)
+        self.schedule_stations = BaseScheduler(self)
+        self.schedule_lines = BaseScheduler(self)
+        # This attribute will keep track of the system time, advancing by 1 second at each step
+        self.system_time = 0
+
+        # Creating tugger trains, charging stations and lines. The agents are also kept in lists, so that they are
+        # looked up by index (the agents of a mesa scheduler are copied into a new list at every access)
+        self.trains = []
+        self.stations = []
+        self.lines = []
+        for tug in range(tugger_train_number):
+            a = Train("Tugger train_" + str(tug+1), self, tug)
+            self.schedule_trains.add(a)
+            self.trains.append(a)
+            
+        for stat in range(self.plant.n_stations):
+            a = ChargingStation("Charging station_"+str(stat), self)
+            self.schedule_stations.add(a)
+            self.stations.append(a)
+        self.station_queue = StationQueue(self.stations)
+
+        for line in range(self.plant.n_lines):   # Lines in the factory
+            a = Line("Line_"+str(line), self, line)
+            self.schedule_lines.add(a)
+            self.lines.append(a)
+
+        # Routing of the tugger trains (see dispatching.py), by default the fixed milk-run over all the lines
+        if dispatching not in policies:
+            raise ValueError("Unknown dispatching policy " + repr(dispatching) + ", available: "
+                             + ", ".join(policies))
+        self.dispatching = dispatching
+        self.dispatcher = policies[dispatching](self)
+
+        # Event list of the event-driven engine: (system time at which the train acts, index of the train).
+        # Every train acts for the first time at the first second of the simulation
+        self.train_events = [(1, order) for order in range(tugger_train_number)]
+
+        # Opt-in timing and event counting (see instrumentation.py): without it the model is not modified
+        if instrumentation is not None:
+            instrumentation.instrument_model(self)
+            
+    def step(self):
+        self.system_time += 1
+        if self.verbose and self.system_time_on:
+            logger.debug("t=%d system_time", self.system_time)
+        self.schedule_lines.step()
+        self.schedule_trains.step()
+        self.schedule_stations.step()
+
+    def random_stream(self, seed):
+        # New random stream of the model (antithetic if the model is)
+        return (u.AntitheticRandom if self.antithetic else random.Random)(seed)
+
+    def line(self, index):
+        """
+        Returns the line index brought up to the system time: trains and dispatching policies read the lines
+        through this method, so that the event-driven engine only updates the lines they actually look at (in
+        every second lines step before trains, so a line is never read before being brought to that second).
+
+        Return
+        -------
+        Line
+        """
+        line = self.lines[index]
+        line.advance_to(self.system_time)
+        return line
+
+    def advance(self, until):
+        # Event-driven alternative to step(): brings the model to the state it would have after calling step()
+        # until system_time == until, but only wakes a train when its task endtime has been reached.
+        # Lines are brought up to date lazily, when a train or the dispatching policy reads them (see line), and
+        # charging stations only change when a train books them, so the cost of an event does not depend on the
+        # number of lines and stations.
+        # Do not mix calls to step() and advance() on the same model.
+        trains = self.trains
+        while self.train_events and self.train_events[0][0] <= until:
+            event_time, order = heapq.heappop(self.train_events)
+            self.system_time = event_time
+            if self.verbose and self.system_time_on:
+                logger.debug("t=%d system_time", self.system_time)
+            train = trains[order]
+            train.step()
+            # A train acts at most once per second, at the first second reaching its task endtime
+            heapq.heappush(self.train_events, (max(math.ceil(train.task_endtime), event_time + 1), order))
+
+        self.system_time = until
+        for line in self.lines:
+            line.advance_to(until)
+        for station in self.stations:
+            station.advance_to(until)
+
+    @classmethod
+    def from_config(cls, config, seed=None, **kwargs):
+        """
+        config: config.Config, seed: seed of the replication
+
+        Returns the model of the plant and of the first hyperparameters of config.
+
+        Return
+        -------
+        FactoryModel
+        """
+        return cls(config.hyper_tugger_train_number[0], config.hyper_tugger_train_capacity[0],
+                   config.hyper_ul_buffer[0], seed=seed, verbose=config.verbose,
+                   system_time_on=config.system_time_on, plant=config.plant(), dispatching=config.dispatching,
+                   **kwargs)
+
+    def mean_idle_time(self):
+        """
+        Returns the average over every second of the idle time of the lines, i.e. the statistic used to find the
+        number of replications N, from the running totals of the lines.
+
+        Return
+        -------
+        float mean idle time [s]
+        """
+        return sum(line.idle_time_area for line in self.lines) / (self.system_time * len(self.lines))
+
+    def summary(self):
+        """
+        Returns the KPIs of the simulation up to the current system time, computed from running totals kept by the
+        agents, so that reading them costs the same whatever the simulated time.
+        The state of lines and stations has the same names as the columns of the grid search trace (Saturation is
+        the fraction of time in which the station was charging). Mean_buffer is the time-weighted average of the
+        unit loads in the buffer, Throughput is in unit loads per hour, Train_utilisation is the fraction of time
+        spent travelling, loading and unloading, Energy_used [kWh] and Queue_time [s] are totals of all the tugger
+        trains. The time of the tugger trains is counted when each task begins.
+
+        Return
+        -------
+        dict KPI name -> value
+        """
+        time = self.system_time
+        kpis = {}
+        for j, line in enumerate(self.lines):
+            kpis["Prod_"+str(j+1)] = line.total_production
+            kpis["UL_in_buffer_"+str(j+1)] = line.UL_in_buffer
+            kpis["Idle_time_"+str(j+1)] = line.idle_time
+            kpis["Mean_buffer_"+str(j+1)] = line.buffer_area/time if time else 0
+            kpis["Throughput_"+str(j+1)] = line.total_production/time*3600 if time else 0
+        for station, agent in enumerate(self.stations):
+            kpis["Saturation_"+str(station+1)] = agent.saturation_time/time if time else 0
+        trains = self.trains
+        kpis["Mean_idle_time"] = self.mean_idle_time() if time else 0
+        kpis["Train_utilisation"] = (sum(train.travel_time + train.handling_time for train in trains)
+                                     / (time*len(trains)) if time and trains else 0)
+        kpis["Energy_used"] = sum(train.energy_used for train in trains)
+        kpis["Queue_time"] = sum(train.queue_time for train in trains)
+        kpis["Charges"] = sum(train.charges for train in trains)
+        return kpis
+
+
+def simulate_idle_time(seed, tugger_train_number, tugger_train_capacity, ul_buffer, n_steps, event_driven=True,
+                       cycle_time_distribution=None, plant=None, dispatching="fixed", common_random_numbers=False,
+                       antithetic=False):
+    """
+    Runs one replication of the model and returns the average over every second of the idle time of the lines
+    (see FactoryModel.mean_idle_time), i.e. the statistic used to find the number of replications N.
+    Every random draw of the replication comes from the random stream of the model, obtained from seed.
+
+    Return
+    -------
+    float mean idle time [s]
+    """
+    model = FactoryModel(tugger_train_number, tugger_train_capacity, ul_buffer, seed=seed,
+                         cycle_time_distribution=cycle_time_distribution, plant=plant, dispatching=dispatching,
+                         common_random_numbers=common_random_numbers, antithetic=antithetic)
+    if event_driven:
+        model.advance(n_steps)
+    else:
+        for _ in range(n_steps):
+            model.step()
+    return model.mean_idle_time()
+
+
+def simulate_antithetic_pair(seed, *args, **kwargs):
+    """
+    Runs an antithetic pair of replications with the same seed (see FactoryModel) and returns their mean idle times
+    (see simulate_idle_time). The averages of different pairs are independent, and have a lower variance than the
+    average of two independent replications when the idle time moves monotonically with the random inputs.
+
+    Return
+    -------
+    list [mean idle time [s], mean idle time of the antithetic replication [s]]
+    """
+    return [simulate_idle_time(seed, *args, antithetic=antithetic, **kwargs) for antithetic in (False, True)]
+
+
+def kpi_series(seed, tugger_train_number, tugger_train_capacity, ul_buffer, n_steps, interval=60, event_driven=True,
+               cycle_time_distribution=None, plant=None, dispatching="fixed"):
+    """
+    Runs one long replication and returns the KPIs of every interval seconds, from the increments of the running
+    totals of the agents: the output series analysed by the steady-state mode (see replications.steady_state).
+    Idle_fraction is the fraction of the interval in which the lines were idle (on average over the lines),
+    Throughput the unit loads produced per hour by all the lines, Train_utilisation the fraction of the interval
+    spent by the tugger trains travelling, loading and unloading (counted when each task begins).
+
+    Return
+    -------
+    dict KPI name -> list
+    """
+    model = FactoryModel(tugger_train_number, tugger_train_capacity, ul_buffer, seed=seed,
+                         cycle_time_distribution=cycle_time_distribution, plant=plant, dispatching=dispatching)
+    series = {"Idle_fraction": [], "Throughput": [], "Train_utilisation": []}
+    previous = (0, 0, 0)
+    for end in range(interval, n_steps + 1, interval):
+        if event_driven:
+            model.advance(end)
+        else:
+            while model.system_time < end:
+                model.step()
+        totals = (sum(line.idle_time for line in model.lines), sum(line.total_production for line in model.lines),
+                  sum(train.travel_time + train.handling_time for train in model.trains))
+        idle, produced, busy = (total - before for total, before in zip(totals, previous))
+        previous = totals
+        series["Idle_fraction"].append(idle / (interval*len(model.lines)))
+        series["Throughput"].append(produced / interval * 3600)
+        series["Train_utilisation"].append(busy / (interval*len(model.trains)) if model.trains else 0)
+    return series
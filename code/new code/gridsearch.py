@@ -0,0 +1,162 @@
+import functools
+import hashlib
+import json
+import multiprocessing
+import os
+from cache import source_fingerprint
+from config import load_plant
+from factory import FactoryModel
+import utils as u
+
+
+@functools.lru_cache(maxsize=None)
+def model_fingerprint(plant_description):
+    # Digest of the plant (its repr, holding all its data) and of the model source code, computed once per plant
+    return hashlib.sha256((plant_description + source_fingerprint()).encode()).hexdigest()[:16]
+
+
+def job_key(ul_buffer, tugger_train_number, tugger_train_capacity, replication, seed, n_steps, plant=None,
+            common_random_numbers=False, antithetic=False):
+    """
+    plant: config.Plant simulated (default: the one of the files in the working directory),
+    common_random_numbers, antithetic: variance reduction of the replication (see run_job)
+
+    Returns the key identifying a (configuration, replication) job in the results store. The key includes the
+    variance reduction and the fingerprint of the plant data and of the model source code, so that the results of
+    other random streams, of another plant, or of a previous version of the model, are not reused.
+
+    Return
+    -------
+    str key
+    """
+    return json.dumps([list(ul_buffer), tugger_train_number, tugger_train_capacity, replication, seed, n_steps,
+                       model_fingerprint(repr(plant or load_plant())), common_random_numbers, antithetic])
+
+
+def run_job(job, plant=None, dispatching="fixed", common_random_numbers=False, antithetic=False):
+    """
+    job: tuple (ul_buffer, tugger_train_number, tugger_train_capacity, replication, seed, n_steps),
+    plant: config.Plant (default: the one of the files in the working directory), dispatching: dispatching policy
+    of the tugger trains (see dispatching.policies), common_random_numbers: replication r of every configuration
+    draws the same random inputs, antithetic: replications 2p and 2p+1 are an antithetic pair (see FactoryModel)
+
+    Simulates one replication of one configuration (event-driven) and returns its summary KPIs together with the
+    hyperparameters. Each job has its own random stream, obtained from the seed of the search (and, without common
+    random numbers, from the configuration).
+
+    Return
+    -------
+    dict record of the results store
+    """
+    ul_buffer, tugger_train_number, tugger_train_capacity, replication, seed, n_steps = job
+    stream = replication // 2 if antithetic else replication
+    if common_random_numbers:
+        model_seed = u.spawn_seed(seed, stream)
+    else:
+        model_seed = u.spawn_seed(seed, ul_buffer, tugger_train_number, tugger_train_capacity, stream)
+    model = FactoryModel(tugger_train_number, tugger_train_capacity, ul_buffer, seed=model_seed, plant=plant,
+                         dispatching=dispatching, common_random_numbers=common_random_numbers,
+                         antithetic=antithetic and replication % 2 == 1)
+    model.advance(n_steps)
+    record = {"key": job_key(*job, plant=plant, common_random_numbers=common_random_numbers, antithetic=antithetic),
+              "Buffer": "-".join(str(size) for size in ul_buffer),
+              "Tugger N": tugger_train_number,
+              "Tugger Capacity": tugger_train_capacity,
+              "Replication": replication,
+              "Dispatching": dispatching,
+              "CRN": common_random_numbers,
+              "Antithetic": antithetic}
+    record.update(model.summary())
+    return record
+
+
+class ResultsStore:
+    """
+    On-disk store of the results of the grid search: a JSON lines file with one record per finished job.
+    Records are appended and flushed as soon as a job finishes, so an interrupted search loses at most the jobs
+    that were running.
+    Only the records run with the variance reduction of the current run (common_random_numbers, antithetic: see
+    run_job) are read back, so that results of other random streams are never mixed with the ones of the run.
+    """
+
+    def __init__(self, path: str, common_random_numbers=False, antithetic=False):
+        self.path = path
+        self.records = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue   # Line truncated by an interrupted run
+                    if (record.get("CRN", False), record.get("Antithetic", False)) != (common_random_numbers,
+                                                                                       antithetic):
+                        continue
+                    self.records[record["key"]] = record
+
+    def __contains__(self, key):
+        return key in self.records
+
+    def add(self, record: dict):
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.records[record["key"]] = record
+
+    def to_dataframe(self):
+        """
+        Return
+        -------
+        pd.DataFrame one row per finished job
+        """
+        import pandas as pd   # Only needed to export the results
+        return pd.DataFrame(list(self.records.values())).drop(columns="key")
+
+
+def grid_jobs(hyper_ul_buffer, hyper_tugger_train_number, hyper_tugger_train_capacity, n_replications, seed, n_steps,
+              store=None, plant=None, common_random_numbers=False, antithetic=False):
+    """
+    hyper_*: lists of hyperparameter values, n_replications: replications per configuration, seed: seed of the
+    search, n_steps: simulated seconds, store: ResultsStore, plant: config.Plant simulated, common_random_numbers,
+    antithetic: variance reduction (see run_job)
+
+    Returns the (configuration, replication) jobs of the grid, leaving out the ones already in store.
+
+    Return
+    -------
+    list of jobs (see run_job)
+    """
+    return [(k, j, h, r, seed, n_steps)
+            for k in hyper_ul_buffer
+            for j in hyper_tugger_train_number
+            for h in hyper_tugger_train_capacity
+            for r in range(n_replications)
+            if store is None or job_key(k, j, h, r, seed, n_steps, plant=plant,
+                                        common_random_numbers=common_random_numbers, antithetic=antithetic)
+            not in store]
+
+
+def grid_search(store, jobs, n_workers=None, cache=None, plant=None, dispatching="fixed", common_random_numbers=False,
+                antithetic=False):
+    """
+    store: ResultsStore, jobs: list of jobs (see grid_jobs), n_workers: processes (None = one per core),
+    cache: ResultCache shared with other searches (optional), plant: config.Plant simulated, dispatching:
+    dispatching policy, common_random_numbers, antithetic: variance reduction (see run_job). The keys of the store
+    do not include the policy: use one store for each policy
+
+    Runs the jobs on a pool of processes and adds each result to the store as soon as it is available, yielding
+    it. Since grid_jobs leaves out the jobs already in the store, rerunning a search after an interruption, or
+    after adding values to the hyperparameter lists, only runs the missing jobs.
+    """
+    if not jobs:
+        return
+    n_workers = min(n_workers or os.cpu_count(), len(jobs))
+    run = functools.partial(run_job, plant=plant, dispatching=dispatching, common_random_numbers=common_random_numbers,
+                            antithetic=antithetic)
+    if cache is not None:
+        run = cache.wrap(run)
+    with multiprocessing.Pool(n_workers) as pool:
+        for record in pool.imap_unordered(run, jobs):
+            store.add(record)
+            yield record
@@ -0,0 +1,205 @@
+import argparse
+import collections
+import cProfile
+import json
+import pstats
+import shutil
+import subprocess
+import sys
+import time
+from dispatching import policies
+from factory import FactoryModel
+
+
+class Instrumentation:
+    """
+    Opt-in instrumentation of FactoryModel (FactoryModel(..., instrumentation=Instrumentation())).
+
+    The methods of the model and of its agents are replaced, on the instances only, by wrappers recording call
+    counts and wall time, and counting the events of the simulation (loads, unloads, charges, queue waits).
+    A model created without instrumentation is not touched, so instrumentation costs nothing when disabled.
+    The same Instrumentation can be attached to several models (and to other objects with wrap, e.g. the trace
+    recorder of the grid search) to collect their totals.
+    """
+
+    # Methods wrapped by instrument_model, per class
+    agent_methods = {"Train": ["step", "check_charge", "move", "wait", "charging", "charge_threshold"],
+                     "Line": ["step", "advance_to", "pick"],
+                     "ChargingStation": ["step", "advance_to"]}
+
+    def __init__(self):
+        self.calls = collections.Counter()   # Calls per method ("Class.method")
+        self.times = collections.defaultdict(float)   # Wall time per method, including nested calls [s]
+        self.group_times = collections.defaultdict(float)   # Wall time per agent type, outermost calls only [s]
+        self.model_time = 0.0   # Wall time spent in FactoryModel.step and FactoryModel.advance [s]
+        self.events = collections.Counter()
+        self.queue_time = 0.0   # Simulated time spent by tugger trains waiting for a charging station [s]
+        self._depth = 0
+
+    def wrap(self, obj, name, group=None, probe=None, top=False):
+        """
+        obj: instance, name: method name, group: group of the method in the summary (default: class of obj),
+        probe: function called with obj before each call (e.g. to count events),
+        top: the method is the entry point of the model (its time includes the time of the agents)
+
+        Replaces obj.name with a wrapper recording its calls and wall time.
+        """
+        method = getattr(obj, name)
+        group = group or type(obj).__name__
+        label = group + "." + name
+
+        def wrapper(*args, **kwargs):
+            if probe is not None:
+                probe(obj)
+            if top:
+                start = time.perf_counter()
+                try:
+                    return method(*args, **kwargs)
+                finally:
+                    self.model_time += time.perf_counter() - start
+                    self.calls[label] += 1
+            self._depth += 1
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                self._depth -= 1
+                self.calls[label] += 1
+                self.times[label] += elapsed
+                if self._depth == 0:
+                    self.group_times[group] += elapsed
+
+        setattr(obj, name, wrapper)
+
+    def instrument_model(self, model):
+        # Called by FactoryModel when it is created with this instrumentation
+        self.wrap(model, "step", group="Model", top=True)
+        self.wrap(model, "advance", group="Model", top=True)
+        probes = {("Train", "charging"): self._count_charge,
+                  ("Train", "move"): self._count_unload,
+                  ("Line", "pick"): self._count_load}
+        for agents in (model.trains, model.lines, model.stations):
+            for agent in agents:
+                for name in self.agent_methods[type(agent).__name__]:
+                    self.wrap(agent, name, probe=probes.get((type(agent).__name__, name)))
+
+    def _count_charge(self, train):
+        station = train.model.stations[train.selected_charging_station]
+        waiting_time = station.waiting_time_at(train.model.system_time)
+        self.events["charges"] += 1
+        if waiting_time > 0:
+            self.events["queue waits"] += 1
+            self.queue_time += waiting_time
+
+    def _count_unload(self, train):
+        # Train.move unloads when it is called at the warehouse after a pick-up tour
+        if train.flag_load and not train.need_to_charge and train.position == train.home:
+            self.events["unloads"] += 1
+
+    def _count_load(self, line):
+        self.events["loads"] += 1
+
+    def to_dict(self):
+        """
+        Returns the collected measures in a JSON-serializable form.
+
+        Return
+        -------
+        dict measures
+        """
+        return {"model_time": round(self.model_time, 6),
+                "agent_times": {group: round(seconds, 6) for group, seconds in self.group_times.items()},
+                "engine_time": round(self.model_time - sum(self.group_times.values()), 6),
+                "methods": {label: {"calls": self.calls[label], "time": round(self.times[label], 6)}
+                            for label in sorted(self.times)},
+                "events": dict(self.events),
+                "queue_time": round(self.queue_time, 2)}
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def summary(self):
+        """
+        Returns the summary table of the collected measures.
+
+        Return
+        -------
+        str table
+        """
+        data = self.to_dict()
+        rows = ["{:<32}{:>12}{:>12}{:>14}".format("Method", "Calls", "Time [s]", "Per call [us]")]
+        for label, measures in sorted(data["methods"].items(), key=lambda item: -item[1]["time"]):
+            rows.append("{:<32}{:>12}{:>12.4f}{:>14.2f}".format(label, measures["calls"], measures["time"],
+                                                                 measures["time"] / measures["calls"] * 1e6))
+        rows.append("")
+        rows.append("{:<32}{:>12.4f}".format("Model (step/advance)", data["model_time"]))
+        for group, seconds in sorted(data["agent_times"].items(), key=lambda item: -item[1]):
+            rows.append("{:<32}{:>12.4f}".format("  " + group, seconds))
+        rows.append("{:<32}{:>12.4f}".format("  Engine and scheduler", data["engine_time"]))
+        rows.append("")
+        for event, count in sorted(data["events"].items()):
+            rows.append("{:<32}{:>12}".format(event.capitalize(), count))
+        rows.append("{:<32}{:>12.1f}".format("Queue time [s]", data["queue_time"]))
+        return "\n".join(rows)
+
+
+def profile_replication(function, *args, output=None, sort="cumulative", limit=25, **kwargs):
+    """
+    function: function running a replication (e.g. factory.simulate_idle_time), output: path of the .prof file
+
+    Runs function(*args, **kwargs) under cProfile, prints the limit most expensive functions and (if output is
+    given) saves the statistics, e.g. for snakeviz. Returns the result of function.
+    """
+    profiler = cProfile.Profile()
+    result = profiler.runcall(function, *args, **kwargs)
+    stats = pstats.Stats(profiler).sort_stats(sort)
+    stats.print_stats(limit)
+    if output:
+        stats.dump_stats(output)
+    return result
+
+
+def run_replication(tugger_train_number, tugger_train_capacity, ul_buffer, n_steps, seed, event_driven=True,
+                    instrumentation=None, plant=None, dispatching="fixed"):
+    model = FactoryModel(tugger_train_number, tugger_train_capacity, ul_buffer, seed=seed,
+                         instrumentation=instrumentation, plant=plant, dispatching=dispatching)
+    if event_driven:
+        model.advance(n_steps)
+    else:
+        for _ in range(n_steps):
+            model.step()
+    return model
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Instrumented or profiled run of a single replication")
+    parser.add_argument("--tugger-number", type=int, default=4)
+    parser.add_argument("--tugger-capacity", type=int, default=4)
+    parser.add_argument("--buffer", type=int, nargs="+", default=[3, 3, 3, 3, 3])
+    parser.add_argument("--steps", type=int, default=int(7.5*3600), help="simulated seconds")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--tick", action="store_true", help="step the model every second")
+    parser.add_argument("--dispatching", default="fixed", choices=sorted(policies), help="dispatching policy")
+    parser.add_argument("--dump", help="JSON file of the instrumentation measures")
+    parser.add_argument("--profile", metavar="FILE", help="run under cProfile and save the statistics to FILE")
+    parser.add_argument("--sample", metavar="FILE", help="run under the py-spy sampling profiler, saving a "
+                                                         "flame graph to FILE")
+    args = parser.parse_args()
+    configuration = (args.tugger_number, args.tugger_capacity, args.buffer, args.steps, args.seed, not args.tick)
+
+    if args.sample:
+        if shutil.which("py-spy") is None:
+            sys.exit("py-spy is not installed (pip install py-spy)")
+        # The same replication, without instrumentation, run by py-spy in a new process
+        command = [sys.executable, sys.argv[0]] + [arg for arg in sys.argv[1:] if arg not in ("--sample", args.sample)]
+        sys.exit(subprocess.call(["py-spy", "record", "-o", args.sample, "--"] + command))
+    elif args.profile:
+        profile_replication(run_replication, *configuration, output=args.profile, dispatching=args.dispatching)
+    else:
+        instrumentation = Instrumentation()
+        run_replication(*configuration, instrumentation=instrumentation, dispatching=args.dispatching)
+        print(instrumentation.summary())
+        if args.dump:
+            instrumentation.dump(args.dump)
@@ -0,0 +1,118 @@
+import numpy as np
+import utils as u
+
+
+class Layout:
+    """
+    Fixed layout of the factory: the warehouse input/output points, the line output points and the charging
+    stations, numbered as nodes (warehouses = 0..n_warehouses-1, then the lines, then the charging stations: see
+    warehouse_node, line_node and station_node).
+
+    The rectilinear distances between every pair of nodes are computed once, when the layout is built, and the
+    travel times without the random delay are computed once per weight class (i.e. per carried weight), so that the
+    tugger trains only look up legs by node index.
+
+    lines_x, lines_y: coordinates of the line output points, warehouses: list of [x, y] of the warehouse
+    input/output points, stations_x, stations_y: coordinates of the charging stations, delay_factors: maximum
+    random delay per metre travelled of the legs of every line (default: u.default_delay_factors)
+    """
+
+    def __init__(self, lines_x, lines_y, warehouses, stations_x, stations_y, delay_factors=None):
+        self.n_warehouses = len(warehouses)
+        self.n_lines = len(lines_x)
+        self.n_stations = len(stations_x)
+        self.nodes_x = [warehouse[0] for warehouse in warehouses] + list(lines_x) + list(stations_x)
+        self.nodes_y = [warehouse[1] for warehouse in warehouses] + list(lines_y) + list(stations_y)
+        n_nodes = len(self.nodes_x)
+
+        # distance[i, j] is the distance travelled from node i to node j (not symmetric, see u.compute_distance)
+        self.distance = np.array([[u.compute_distance(self.nodes_x[i], self.nodes_x[j], self.nodes_y[i], self.nodes_y[j])
+                                   for j in range(n_nodes)] for i in range(n_nodes)])
+
+        # max_delay[i, j] is the maximum random delay [s] of the leg from node i to node j (see u.max_delay): it
+        # depends on the line the tugger train is heading to, or coming from when it goes back to a warehouse
+        if delay_factors is None:
+            delay_factors = u.default_delay_factors(self.n_lines)
+        if len(delay_factors) != self.n_lines:
+            raise ValueError("delay_factors has " + str(len(delay_factors)) + " factors, but the layout has "
+                             + str(self.n_lines) + " lines")
+        self.delay_factors = [float(factor) for factor in delay_factors]
+        factor = [self.delay_factors[self.line_index(j)] if self.is_line(j) else u.base_delay_factor
+                  for j in range(n_nodes)]
+        self.max_delay = np.array([[u.max_delay(self.distance[i, j], factor[i] if self.is_warehouse(j) else factor[j])
+                                    for j in range(n_nodes)] for i in range(n_nodes)])
+
+        # Travel times without delay, per carried weight [kg] (see base_time)
+        self._base_times = {}
+
+    def __eq__(self, other):
+        # Layouts with the same nodes are equal, so that quantities cached per layout are shared by equal layouts
+        # and recomputed when the layout changes (see energy.charge_threshold)
+        return isinstance(other, Layout) and ((self.n_warehouses, self.n_lines, self.nodes_x, self.nodes_y,
+                                               self.delay_factors)
+                                              == (other.n_warehouses, other.n_lines, other.nodes_x, other.nodes_y,
+                                                  other.delay_factors))
+
+    def __hash__(self):
+        return hash((self.n_warehouses, self.n_lines, tuple(self.nodes_x), tuple(self.nodes_y),
+                     tuple(self.delay_factors)))
+
+    def tour(self, warehouse=0):
+        """
+        Returns the legs (origin, destination) of the milk-run from warehouse (index) to the last line.
+
+        Return
+        -------
+        list of (node, node)
+        """
+        stops = [self.warehouse_node(warehouse)] + [self.line_node(line) for line in range(self.n_lines)]
+        return list(zip(stops[:-1], stops[1:]))
+
+    def warehouse_node(self, warehouse):
+        return warehouse
+
+    def line_node(self, line):
+        return self.n_warehouses + line
+
+    def station_node(self, station):
+        return self.n_warehouses + self.n_lines + station
+
+    def is_warehouse(self, node):
+        return node < self.n_warehouses
+
+    def is_line(self, node):
+        return self.n_warehouses <= node < self.n_warehouses + self.n_lines
+
+    def line_index(self, node):
+        return node - self.n_warehouses
+
+    def base_time(self, weight):
+        """
+        weight: weight [kg] carried by the tugger train
+
+        Returns the matrix of the travel times between the nodes without the random delay, including the fixed
+        amount for acceleration and deceleration (8 s). The matrix is computed once per weight.
+
+        Return
+        -------
+        array time [s]
+        """
+        times = self._base_times.get(weight)
+        if times is None:
+            times = self.distance / u.compute_speed(weight) + 8
+            self._base_times[weight] = times
+        return times
+
+    def travel_time(self, origin, destination, weight, rng):
+        """
+        origin, destination: nodes, weight: carried weight [kg], rng: random.Random used to draw the delay
+
+        Returns the time needed for the leg, with a single random delay. The same time must be used for the energy
+        consumed (u.compute_energy), so that the energy matches the time actually spent travelling.
+
+        Return
+        -------
+        float time [s]
+        """
+        return float(self.base_time(weight)[origin, destination]
+                     + rng.uniform(0.0, 1.0) * self.max_delay[origin, destination])
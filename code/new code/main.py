@@ -1,471 +1,359 @@
-import statistics
-from mesa import Agent, Model
-from mesa.time import BaseScheduler
-import random
+"""
+Simulation of the tugger trains serving the production lines.
+
+Run from this folder:
+    python main.py simulate [scenario] [--set name=value ...]   Single run of the first configuration
+    python main.py find-n [scenario] [--set name=value ...]     Number of replications N for the required precision
+    python main.py steady-state [scenario] [--set name=value ...]   Steady-state KPIs from one long run
+    python main.py sweep [scenario] [--set name=value ...]      Grid search over the hyperparameters
+    python main.py optimise [scenario] [--set name=value ...]   Cheapest feasible configuration (racing)
+    python main.py bench [scenario ...] [--compare file]        Benchmark (see benchmark.py)
+
+scenario is a TOML or YAML file overriding the default settings (see config.Config and scenarios/default.toml),
+and --set overrides single settings, e.g. --set n_shift=1 --set hyper_ul_buffer=[[2,2,2,2,2]].
+"""
+import argparse
+import functools
+from factory import FactoryModel, kpi_series, simulate_antithetic_pair, simulate_idle_time
+from replications import ReplicationRunner, reduced_variance, sequential_replications, steady_state
+from batch import simulate_idle_time_batch
+from gridsearch import ResultsStore, grid_jobs, grid_search, job_key
+from optimisation import racing_search, fleet_cost, per_line_buffers
+from cache import ResultCache
+from config import Config, parse_setting
+from instrumentation import Instrumentation
+import benchmark
 import utils as u
-import pandas as pd
-import scipy.stats
-import matplotlib.pyplot as plt
-from time import sleep
 import csv
 
-import importlib
-importlib.reload(u)
+# Analysis, export and plotting libraries (pandas, scipy, pyarrow, matplotlib) are imported by the functions
+# using them, so that a run, and every worker process, only loads what it needs
 
 
-#############################
-# Read file for coordinates #
-#############################
-path = "./lines_info.csv"
-lines_output_points_x, lines_output_points_y, lines_cycle_times, output_weight = u.read_line_info(path)
-
-#################################
-# Read file for charging phases #
-#################################
-path = "./charging.csv"
-charging_dict = u.read_charging_phases(path)
-
-
-##############
-# Parameters #
-##############
-# Simulation parameters
-n_shift = 2   # Shifts per day
-wh = 7.5  # Working Hours per shift
-seed = 42
-
-# Model Parameters
-warehouse_coord = [0, 80]   # x and y coordinates of the warehouse input point
-charging_stations_x = [0, 0]   # x coordinates of the first and second charging station, respectively
-charging_stations_y = [10, 20]   # y coordinates of the first and second charging station, respectively
-battery_size = 4.8   # kWh
-
-# Debug parameters
-verbose = False   # Run a verbose simulation
-system_time_on = False   # Print system time
-check_model_output = False  # Check if data collection was successful
-isSearching = False  # Perform grid search
-verboseSearch = False  # Show each combination of hyperparameters
-
-
-# Parameters to find N
-findN = True  # Set to True to find N
-N = 5000
-alpha = 0.05
-precision = 0.0125
-
-# Save output
-path = "./output/"
-export_df_to_csv = False  # Export df with collected data to csv
-export_df_to_feather = False  # Export df to feather format
-# Note that to have system time both verbose and system_time_on must be True
-# Note that check_model_output is working properly only when isSearching = True
-
-
-
-#########################
-# Model hyperparameters #
-#########################
-
-# If isSearching = False and more than 1 parameter is specified, just the first element of the list will be used
-# Same for findN
-hyper_tugger_train_number = [4]
-hyper_ul_buffer = [[3, 3, 3, 3, 3]]
-hyper_tugger_train_capacity = [4]
-
-
-
-##########################################
-# List to keep track of system evolution #
-##########################################
-lines_production = {0: [], 1: [], 2: [], 3: [], 4: []}
-lines_buffer = {0: [], 1: [], 2: [], 3: [], 4: []}
-lines_idle = {0: [], 1: [], 2: [], 3: [], 4: []}
-charging_status = {0: [], 1: []}
-
-param_buff = []
-param_capacity = []
-param_tuggers = []
-time = []
-
-class Train(Agent):
-    def __init__(self, unique_id, model):
-        super().__init__(unique_id, model)
-        self.battery_size = battery_size   # [kWh]
-
-        # initial battery charge is 60% and 100% of the maximum
-        self.remaining_energy = battery_size * random.uniform(0.6, 1)   # [kWh]
-        self.capacity = tugger_train_capacity   # Maximum number of unit loads which can be loaded on a tugger train
-        self.load = 0   # Current load of the tugger train
-
-        # Current position of the tugger train. The starting position is the warehouse input/output point
-        self.pos_x = warehouse_coord[0]
-        self.pos_y = warehouse_coord[1]
-
-        # This attribute will be updated with the x coordinate of the next line/charging station/warehouse to be visited
-        self.next_stop_x = lines_output_points_x[0]
-
-        # This attribute will be updated with the y coordinate of the next line/charging station/warehouse to be visited
-        self.next_stop_y = lines_output_points_y[0]
-
-        # Increased by a value equal to the task duration every time the tugger train completes a task
-        self.task_endtime = 0
-
-        # Id of the next line output point to be visited
-        self.next_line = 0
-
-        # This attribute will be True if the vehicle needs to charge
-        self.need_to_charge = False
-
-        # This attribute will be updated with the ID of the charging station where the vehicle is going to charge
-        self.selected_charging_station = None
-        self.weight_capacity = 2000
-        self.weight = 0
-
-        # Attribute to correct the functioning of the loading
-        self.flag_load = False
-
-    def check_charge(self):
-        # Function that checks if the vehicle battery level is enough to perform the following pick-up tour
-        if self.remaining_energy < self.charge_threshold():
-            # One of the charging stations is randomly selected
-            # self.selected_charging_station = random.choice(range(len(charging_stations_x)))
-            self.selected_charging_station = self.model.schedule_stations.agents.index(min(self.model.schedule_stations.agents, 
-                                                                                           key=lambda x:x.waiting_time))
-            self.next_stop_x = charging_stations_x[self.selected_charging_station]
-            self.next_stop_y = charging_stations_y[self.selected_charging_station]
-            self.need_to_charge = True
-            if verbose:
-                print("\n\n", self.unique_id, "in need of charging\n- Remaining charge:", round(self.remaining_energy, 4), "KWh\n- Going to recharge at station", self.selected_charging_station, "\n   - Travelled distance:", u.compute_distance(self.pos_x, self.next_stop_x, self.pos_y, self.next_stop_y), "m")
-            
-        else: 
-            self.next_line = 0
-            self.next_stop_x = lines_output_points_x[self.next_line]
-            self.next_stop_y = lines_output_points_y[self.next_line]
-            
-    def move(self):
-        if (not self.flag_load) or (self.next_stop_x == warehouse_coord[0] and self.next_stop_y == warehouse_coord[1] and self.pos_x== 20.0 and self.pos_y == 80.0) :
-            distance_next_stop = u.compute_distance(self.pos_x, self.next_stop_x, self.pos_y, self.next_stop_y)
-            if self.flag_load: 
-                if verbose:
-                    print("\n\n" + self.unique_id, "going to the warehouse", "\n- Travelled distance:",
-                          distance_next_stop, "m")
+def warn_first_configuration(config):
+    # If more than 1 parameter is specified, just the first element of the lists is used by simulate and find-n
+    if (len(config.hyper_tugger_train_number) + len(config.hyper_ul_buffer)
+            + len(config.hyper_tugger_train_capacity)) > 3:
+        print("*****\nWarning: you decided to run the model just for one configuration but you provided more than one "
+              "combination of a parameters. The first combination of parameters was used.\n*****")
 
-            else:
-                if verbose:
-                    print("\n\n", self.unique_id + " going to line", self.next_line,
-                          "\n- Travelled distance:", distance_next_stop, "m", "\n- Carried weight: ", self.weight, "kg",
-                          "\n- Task endtime:", round(self.task_endtime / 3600, 2), "h", "\n\n" + self.unique_id,
-                          "at line", self.next_line)
-            self.task_endtime += u.compute_time(distance_next_stop,
-                                                speed=u.compute_speed(self.weight),
-                                                nextline=self.next_line)
-            self.remaining_energy -= u.compute_energy(
-                u.compute_time(distance_next_stop, speed=u.compute_speed(self.weight), nextline=self.next_line))
-            self.pos_x = self.next_stop_x
-            self.pos_y = self.next_stop_y
-            self.flag_load = True
 
+def store_path(config):
+    # Results store of the grid search: one per dispatching policy, which the keys of the jobs do not include, and
+    # per variance reduction
+    name = "grid_results"
+    if config.dispatching != "fixed":
+        name += "_" + config.dispatching
+    if config.common_random_numbers:
+        name += "_crn"
+    if config.antithetic:
+        name += "_antithetic"
+    return config.path + name + ".jsonl"
+
+
+def report_variance_reduction(config, store):
+    # Mean idle time of every configuration of the sweep and, with common random numbers, its difference from the
+    # first configuration, with the replications needed compared with independent replications
+    replications = config.grid_replications - (config.grid_replications % 2 if config.antithetic else 0)
+    if replications < (4 if config.antithetic else 2):
+        print("Variance reduction: at least", 4 if config.antithetic else 2, "grid replications are needed to "
+              "estimate it.")
+        return
+    configurations = [(k, j, h) for k in config.hyper_ul_buffer
+                      for j in config.hyper_tugger_train_number
+                      for h in config.hyper_tugger_train_capacity]
+    plant = config.plant()
+
+    def results(ul_buffer, tugger_train_number, tugger_train_capacity):
+        return [store.records[job_key(ul_buffer, tugger_train_number, tugger_train_capacity, r, config.seed,
+                                      config.n_steps, plant=plant, common_random_numbers=config.common_random_numbers,
+                                      antithetic=config.antithetic)]["Mean_idle_time"] for r in range(replications)]
+
+    baseline = results(*configurations[0])
+    print("\nVARIANCE REDUCTION (mean idle time [s], " + str(int((1 - config.alpha)*100)) + "% confidence "
+          "intervals; replications needed relative to independent replications)")
+    for configuration in configurations:
+        observations = results(*configuration)
+        estimate = reduced_variance(observations, antithetic=config.antithetic, alpha=config.alpha)
+        print("Buffer", configuration[0], "- tugger N", configuration[1], "- tugger capacity", configuration[2])
+        # Common random numbers do not change the variance of a single configuration
+        print("   Mean:", round(estimate.mean, 2), "+/-", round(estimate.half_width, 2),
+              *(["- replications needed:", str(round(estimate.ratio*100, 1)) + "%"] if config.antithetic else []))
+        if config.common_random_numbers and configuration != configurations[0]:
+            difference = reduced_variance(observations, baseline, antithetic=config.antithetic, alpha=config.alpha)
+            print("   Difference from the first configuration:", round(difference.mean, 2), "+/-",
+                  round(difference.half_width, 2), "- replications needed:",
+                  str(round(difference.ratio*100, 1)) + "%")
+
+
+def sweep(config, cache):
+    plant = config.plant()
+    if config.record_trace:
+        if config.antithetic:
+            raise ValueError("The traced sweep (record_trace) runs one replication per configuration, so it does not "
+                             "run antithetic pairs")
+        from recorder import TraceRecorder
+        combination = (len(config.hyper_tugger_train_capacity)*len(config.hyper_ul_buffer)
+                       * len(config.hyper_tugger_train_number))
+        n_steps = config.n_steps
+        total = combination*n_steps
+        # The evolution of the system is kept in columns preallocated for all the combinations, or streamed to
+        # the Parquet dataset a chunk at a time
+        if config.export_df_to_parquet:
+            from sink import ParquetSink
+            recorder = TraceRecorder(config.parquet_chunk, n_lines=plant.n_lines, n_stations=plant.n_stations,
+                                     only_changes=config.record_only_changes,
+                                     sink=ParquetSink(config.path + "trace"))
         else:
-            # If the next stop is not a charging station
-            if not self.need_to_charge:
-                # If the reached position is a line output point (and not the warehouse)
-                if (self.pos_x, self.pos_y) != (warehouse_coord[0], warehouse_coord[1]):
-                    # If there is at least one unit load at the line output point
-                    while self.model.schedule_lines.agents[self.next_line].UL_in_buffer >= 1:
-                        if self.load < self.capacity:
-                            if (self.weight + output_weight[self.next_line]) <= self.weight_capacity:
-                                if verbose:
-                                    print("- Picking up a unit load", "\n   - Task endtime:",
-                                          round(self.task_endtime/3600, 2), "h")
-                                    
-                                # Loading time (between 30 seconds and 60 seconds)
-                                loading_time = random.uniform(30, 60)
-                                self.task_endtime += loading_time
-                                self.remaining_energy -= u.compute_energy_loading(output_weight[self.next_line])
-                                self.model.schedule_lines.agents[self.next_line].UL_in_buffer -= 1
-                                self.load += 1
-                                self.weight += output_weight[self.next_line]
-                            else:
-                                if verbose:
-                                    print("- Not enough weight capacity left")
-                                break
+            recorder = TraceRecorder(combination*(n_steps//config.sample_interval), n_lines=plant.n_lines,
+                                     n_stations=plant.n_stations, only_changes=config.record_only_changes)
+        instrumentation = Instrumentation() if config.instrument else None
+        if config.instrument:
+            instrumentation.wrap(recorder, "record", group="TraceRecorder", top=True)
+        print("Starting...")
+        progress = u.Progress(total, unit="sim-s")
+        for k in config.hyper_ul_buffer:
+            for j in config.hyper_tugger_train_number:
+                for h in config.hyper_tugger_train_capacity:
+                    tugger_train_capacity = h
+                    tugger_train_number = j
+                    ul_buffer = k
+                    if config.verboseSearch:
+                        print("Started with (buffer, tugger N, tugger capacity):",
+                              k, "-", j, "-", h)
+                    # Every grid point has its own random stream
+                    # With common random numbers every configuration shares the random inputs
+                    seed = (u.spawn_seed(config.seed) if config.common_random_numbers
+                            else u.spawn_seed(config.seed, k, j, h))
+                    model = FactoryModel(tugger_train_number, tugger_train_capacity, ul_buffer, seed=seed,
+                                         verbose=config.verbose, system_time_on=config.system_time_on,
+                                         instrumentation=instrumentation, plant=plant,
+                                         dispatching=config.dispatching,
+                                         common_random_numbers=config.common_random_numbers)
+                    for i in range(config.sample_interval, n_steps + 1, config.sample_interval):
+                        if config.event_driven:
+                            model.advance(i)
                         else:
-                            if verbose:
-                                print("- Not enough loading capacity left")
-                            break
-                    else:
-                        if verbose:
-                            print("- No (more) unit loads to be picked up")
-                else:
-                    if verbose:
-                        print("- Unloading", self.load, "unit loads")
-                    unloading_time = 30 + random.uniform(30, 60)*self.load
-                    self.task_endtime += unloading_time
-                    self.remaining_energy -= u.compute_energy_loading(self.weight)
-                    self.load = 0
-                    self.weight = 0
-                    self.next_line = 0
-                    self.flag_load = False
-
-                if self.next_line >= 4:
-                    self.next_stop_x = warehouse_coord[0]
-                    self.next_stop_y = warehouse_coord[1]
-                    # if verbose:
-                    #    print("- Going back to the warehouse")
-
-                else:
-                    self.next_line += 1
-                    self.next_stop_x = lines_output_points_x[self.next_line]
-                    self.next_stop_y = lines_output_points_y[self.next_line]
-                    self.flag_load = False
-                    
-            if verbose:
-                print("   - Task endtime:", round(self.task_endtime/3600, 2), "h", "\n   - Carried weight: ",
-                      self.weight, "kg")
-        
-    def charging(self):
-        # Function that simulates the (possible) queuing at the charging station and the battery charging:
-        # Queuing time (waiting for the charging station to be available):
-        # schedule_stations.agents contains the list of all ChargingStation agents
-        self.task_endtime += self.model.schedule_stations.agents[self.selected_charging_station].waiting_time
-
-        # The battery is fully charged
-        charging_size = self.battery_size - self.remaining_energy
-        charging_time = u.compute_charging_time(charging_dict, self.remaining_energy, self.battery_size)  # seconds
-        self.remaining_energy += charging_size
-        self.model.schedule_stations.agents[self.selected_charging_station].waiting_time += charging_time
-        self.model.schedule_stations.agents[self.selected_charging_station].task_endtime = self.model.schedule_stations.agents[self.selected_charging_station].waiting_time+self.model.system_time
-        self.task_endtime += charging_time
-        if verbose:
-            print("   - Task endtime:", round(self.task_endtime/3600, 2), "h", "\n   - Remaining charge:",
-                  self.remaining_energy, "KWh")
-
-        self.next_line = 0
-        self.need_to_charge = False
-        self.pos_x = charging_stations_x[self.selected_charging_station]
-        self.pos_y = charging_stations_y[self.selected_charging_station]
-        self.next_stop_x = lines_output_points_x[self.next_line]
-        self.next_stop_y = lines_output_points_y[self.next_line]
-
-    def charge_threshold(self):
-        # consumo per viaggare carico al massimo, consume per caricare e scaricare tutti i pallet,
-        time = 0
-        line_output_for_charging_x = [0]+lines_output_points_x+[0]
-        line_output_for_charging_y = [80]+lines_output_points_y+[80]
-        for i in range(5):
-            time += u.compute_time(u.compute_distance(x1=line_output_for_charging_x[i],
-                                                      x2=line_output_for_charging_x[i+1],
-                                                      y1=line_output_for_charging_y[i],
-                                                      y2=line_output_for_charging_y[i+1]),
-                                   speed=u.compute_speed(weight=self.weight_capacity),
-                                   random_flag=False)
-        time += 190+u.compute_time(u.compute_distance(x1=0, x2=0, y1=80, y2=10),
-                                   speed=u.compute_speed(weight=0),
-                                   random_flag=False)
-        est_consumption = u.compute_energy(time=time)+u.compute_energy_loading(weight=self.weight_capacity)*2
-        return est_consumption
-    
-    def step(self):
-        if self.task_endtime <= self.model.system_time:
-            if (self.pos_x, self.pos_y) == (warehouse_coord[0], warehouse_coord[1]) and self.flag_load == False:
-                self.check_charge()
-            if self.need_to_charge:
-                self.charging()
-                self.move()
-            else:
-                self.move()
-
-
-class ChargingStation(Agent):
-    def __init__(self, unique_id, model):
-        super().__init__(unique_id, model)
-        # Time that a tugger train must wait before beginning its charging process at this station
-        self.waiting_time = 0
-        self.task_endtime = 0
-        self.is_charging = False
-
-    def step(self):
-        # Step duration: 1 second
-        if self.task_endtime > self.model.system_time:
-            self.is_charging = True
+                            while model.system_time < i:
+                                model.step()
+                        recorder.record(model, k, j, h)
+                        progress.update(config.sample_interval)
+
+        progress.close()
+        print("Hyperparameter search simulation completed.")
+        print(combination, "Number of hyperparameters combinations have been performed.")
+        print("Total iterations:", total)
+        if config.instrument:
+            print(instrumentation.summary())
+            instrumentation.dump(config.path + "instrumentation.json")
+
+        if config.export_df_to_parquet:
+            print("Saving the last records to parquet.")
+            recorder.flush()
         else:
-            self.is_charging = False
-        if self.waiting_time >= 1:
-            self.waiting_time -= 1
-        else:
-            self.waiting_time = 0   # Potrebbe essere inutile?
-
-
-class Line(Agent):
-    def __init__(self, unique_id, model):
-        super().__init__(unique_id, model)
-
-        # The last character in the unique_id is the number indicating the line (see FactoryModel)
-        self.line_index = int(self.unique_id[-1])
-
-        # Production time of one unit load (minutes)
-        self.cycle_time = lines_cycle_times[self.line_index]
-
-        # Maximum number of unit Loads in the buffer at the line output point
-        self.buffer_size = ul_buffer[self.line_index]
-
-        # Actual number of unit loads in the buffer at the line output point.
-        # The buffer is empty at the beginning of the simulation
-        self.UL_in_buffer = 0
-
-        # Overall number of unit loads produced by the line
-        self.total_production = 0
-
-        # Time (minutes) during which the station is not producing since the buffer is full
-        self.idle_time = 0
-
-        # Attribute needed to simulate the production of one unit load "every cycle time" (see the step function)
-        self.count_time = 0
+            dataframe = recorder.to_dataframe()
+            if config.export_df_to_csv:
+                print("Saving dataframe to csv.")
+                dataframe.to_csv(config.path + "dataframe.csv", index=False)
+
+            if config.export_df_to_feather:
+                print("Saving dataframe to feather.")
+                dataframe.to_feather(config.path + "dataframe.feather")
+
+    else:
+        # (Configuration, replication) jobs run in parallel and their summary KPIs are saved as soon as they
+        # finish: the jobs already in the results store are not run again
+        store = ResultsStore(store_path(config), common_random_numbers=config.common_random_numbers,
+                             antithetic=config.antithetic)
+        jobs = grid_jobs(config.hyper_ul_buffer, config.hyper_tugger_train_number, config.hyper_tugger_train_capacity,
+                         config.grid_replications, config.seed, config.n_steps, store=store, plant=plant,
+                         common_random_numbers=config.common_random_numbers, antithetic=config.antithetic)
+        total = (len(config.hyper_ul_buffer)*len(config.hyper_tugger_train_number)
+                 * len(config.hyper_tugger_train_capacity)*config.grid_replications)
+        print("Starting...", total - len(jobs), "of", total, "jobs already in the results store.")
+        with u.Progress(len(jobs), unit="jobs") as progress:
+            for record in grid_search(store, jobs, n_workers=config.n_workers, cache=cache, plant=plant,
+                                      dispatching=config.dispatching,
+                                      common_random_numbers=config.common_random_numbers,
+                                      antithetic=config.antithetic):
+                if config.verboseSearch:
+                    print("\nCompleted (buffer, tugger N, tugger capacity, replication):",
+                          record["Buffer"], "-", record["Tugger N"], "-", record["Tugger Capacity"], "-",
+                          record["Replication"])
+                progress.update()
+
+        print("Hyperparameter search simulation completed.")
+        if config.common_random_numbers or config.antithetic:
+            report_variance_reduction(config, store)
+        dataframe = store.to_dataframe()
+        if config.export_df_to_csv:
+            print("Saving results to csv.")
+            dataframe.to_csv(config.path + "grid_results.csv", index=False)
+
+
+def optimise(config, cache):
+    plant = config.plant()
+    configurations = [(k, j, h)
+                      for k in per_line_buffers(config.buffer_options, n_lines=plant.n_lines)
+                      for j in config.hyper_tugger_train_number
+                      for h in config.hyper_tugger_train_capacity]
+    print("Racing", len(configurations), "configurations...")
+    store = ResultsStore(store_path(config), common_random_numbers=config.common_random_numbers,
+                         antithetic=config.antithetic)
+    cost = functools.partial(fleet_cost, tugger_cost=config.tugger_cost, wagon_cost=config.wagon_cost,
+                             buffer_cost=config.buffer_cost)
+    best, candidates, replications_run = racing_search(store, configurations, cost, config.idle_target,
+                                                       config.n_shift, config.seed, config.n_steps,
+                                                       alpha=config.alpha,
+                                                       initial_replications=config.initial_replications,
+                                                       max_replications=config.max_replications,
+                                                       n_workers=config.n_workers, cache=cache, plant=plant,
+                                                       dispatching=config.dispatching,
+                                                       common_random_numbers=config.common_random_numbers,
+                                                       antithetic=config.antithetic)
+    # Whole antithetic pairs, as in racing_search
+    max_replications = config.max_replications + (config.max_replications % 2 if config.antithetic else 0)
+    print("Replications run:", replications_run,
+          "(the full grid would need", len(configurations)*max_replications, "replications)")
+    if best is None:
+        print("No configuration was found to be feasible.")
+    else:
+        lower, upper = best.interval(config.alpha)
+        print("\nCHEAPEST FEASIBLE CONFIGURATION:",
+              "\nTugger train number:", best.tugger_train_number,
+              "\nTugger train capacity:", best.tugger_train_capacity,
+              "\nUL buffer line(in order):", best.ul_buffer,
+              "\nCost:", round(best.cost, 2),
+              "\nWorst line idle time per shift [s]:", round(best.stats.mean, 2),
+              [round(lower, 2), round(upper, 2)], "over", best.stats.n * (2 if config.antithetic else 1),
+              "replications")
+
+
+def find_n(config, cache):
+    # This allows to understand which is the correct number of N to reach a reasonable half-width
+    # Parameters' setup: This should be coherent with what tried in the sweep result
+    tugger_train_number = config.hyper_tugger_train_number[0]
+    tugger_train_capacity = config.hyper_tugger_train_capacity[0]
+    ul_buffer = config.hyper_ul_buffer[0]
+    alpha, precision, N = config.alpha, config.precision, config.N
+    # Replications run in parallel, each one with its own random stream. The runner keeps the replications
+    # already performed, so increasing N only runs the new ones
+    if config.backend == "batch":
+        if config.dispatching != "fixed":
+            raise ValueError("The batch backend only simulates the fixed dispatching policy")
+        if config.antithetic:
+            raise ValueError("The batch backend does not run antithetic pairs")
+        if any(config.plant().cycle_time_spread):
+            raise ValueError("The batch backend only simulates deterministic cycle times (cycle_time_spread = 0)")
+        runner = ReplicationRunner(cache.wrap(functools.partial(simulate_idle_time_batch,
+                                                                n_replications=config.batch_size,
+                                                                tugger_train_number=tugger_train_number,
+                                                                tugger_train_capacity=tugger_train_capacity,
+                                                                ul_buffer=ul_buffer,
+                                                                n_steps=config.n_steps,
+                                                                plant=config.plant())),
+                                   seed=config.seed, n_workers=config.n_workers, chunksize=1,
+                                   batch_size=config.batch_size)
+    else:
+        # Antithetic pairs run together, as batches of two replications
+        runner = ReplicationRunner(cache.wrap(functools.partial(simulate_antithetic_pair if config.antithetic
+                                                                else simulate_idle_time,
+                                                                tugger_train_number=tugger_train_number,
+                                                                tugger_train_capacity=tugger_train_capacity,
+                                                                ul_buffer=ul_buffer,
+                                                                n_steps=config.n_steps,
+                                                                event_driven=config.event_driven,
+                                                                plant=config.plant(),
+                                                                dispatching=config.dispatching,
+                                                                common_random_numbers=config.common_random_numbers)),
+                                   seed=config.seed, n_workers=config.n_workers,
+                                   batch_size=2 if config.antithetic else 1)
+    # The averages of the antithetic pairs are the independent observations
+    group = 2 if config.antithetic else 1
+    print("Starting the procedure to find N...")
+    if config.sequential:
+        with u.Progress(unit="replications") as progress:
+            result = sequential_replications(runner, alpha, precision, min_replications=config.min_N,
+                                             max_replications=config.max_N, progress=progress, group=group)
+        N = result.n
+        print("Mean idle time:", round(result.mean, 2), "s",
+              "\nConfidence interval (" + str(int((1 - alpha)*100)) + "%):",
+              [round(bound, 2) for bound in result.ci], "s",
+              "\nElapsed time:", round(result.elapsed, 2), "s")
+        if result.half_width > precision*result.mean:
+            print("*****\nWarning: the required precision was not reached within", config.max_N,
+                  "replications\n*****")
+        with open("./mean.csv", "w") as f:
+            writer = csv.writer(f)
+            writer.writerow(runner.results[:N])
+    else:
+        N += N % group   # Whole antithetic pairs
+        while True:
+            print("Testing N:", N)
+            with u.Progress(runner.pending(N), unit="replications") as progress:
+                for mean_idle_time in runner.run(N):
+                    progress.update()
+            mean_idle_times = runner.results[:N] # List of means
+            # Half-width of the t-based confidence interval (of the averages of the pairs with antithetic pairs)
+            estimate = reduced_variance(mean_idle_times, antithetic=config.antithetic, alpha=alpha)
+            if estimate.half_width <= precision*estimate.mean:
+                with open("./mean.csv", "w") as f:
+                    writer = csv.writer(f)
+                    writer.writerow(mean_idle_times)
+                break
+            else:
+                N = N + 500
 
-    def step(self):
-        # If the buffer is not full
-        if self.UL_in_buffer < self.buffer_size:
-            self.count_time += 1
-            if self.count_time == self.cycle_time:    
-                self.total_production += 1
-                self.UL_in_buffer += 1
-                self.count_time = 0
-        else:
-            self.idle_time += 1
-
-
-class FactoryModel(Model):
-    def __init__(self, seed=None):
-        super().__init__()
-        self.schedule_trains = BaseScheduler(self)
-        self.schedule_stations = BaseScheduler(self)
-        self.schedule_lines = BaseScheduler(self)
-        # This attribute will keep track of the system time, advancing by 1 second at each step
-        self.system_time = 0
-
-        # Creating tugger trains, charging stations and lines:
-        for tug in range(tugger_train_number):
-            a = Train("Tugger train_" + str(tug+1), self)
-            self.schedule_trains.add(a)
-            
-        for stat in range(len(charging_stations_x)):
-            a = ChargingStation("Charging station_"+str(stat), self)
-            self.schedule_stations.add(a)
-
-        for line in range(5):   # Lines in the factory
-            a = Line("Line_"+str(line), self)
-            self.schedule_lines.add(a)
-            
-    def step(self):
-        self.system_time += 1
-        if verbose and system_time_on:
-            print("System time: " + str(self.system_time))
-        self.schedule_lines.step()
-        self.schedule_trains.step()
-        self.schedule_stations.step()
-
-
-##########################
-# Running the simulation #
-##########################
-
-if isSearching:
-    counting = 0
-    combination = len(hyper_tugger_train_capacity)*len(hyper_ul_buffer)*len(hyper_tugger_train_number)
-    total = int(combination*n_shift*wh*3600)
-    print("Starting...")
-    for k in hyper_ul_buffer:
-        for j in hyper_tugger_train_number:
-            for h in hyper_tugger_train_capacity:
-                tugger_train_capacity = h
-                tugger_train_number = j
-                ul_buffer = k
-                if verboseSearch:
-                    print("Started with (buffer, tugger N, tugger capacity):",
-                          k, "-", j, "-", h)
-                model = FactoryModel(seed=seed)
-                for i in range(int(n_shift*wh*3600)):
-                    model.step()
-                    time.append(i)
-                    param_buff.append(k)
-                    param_capacity.append(h)
-                    param_tuggers.append(j)
-                    for z in range(5):
-                        lines_production[z].append(model.schedule_lines.agents[z].total_production)
-                        lines_buffer[z].append(model.schedule_lines.agents[z].UL_in_buffer)
-                        lines_idle[z].append(model.schedule_lines.agents[z].idle_time)
-                    for station in range(2):
-                        charging_status[station].append(model.schedule_stations.agents[station].is_charging)
-
-                    u.progress(int(round(counting/total*100, 0)))
-                    counting += 1
-                    
-                    print("\Hyperparameter search simulation completed.")
-                    print(combination, "Number of hyperparameters combinations have been performed.")
-                    print("Total iterations:", total)
-                
-                    dataframe = pd.DataFrame(zip(time, param_buff, param_tuggers, param_capacity),
-                                             columns=["Time", "Buffer", "Tugger N", "Tugger Capacity"])
-                
-                    for j in range(5):
-                        dataframe["Prod_"+str(j+1)] = lines_production[j]
-                        dataframe["UL_in_buffer_"+str(j+1)] = lines_buffer[j]
-                        dataframe["Idle_time_"+str(j+1)] = lines_idle[j]
-                    for station in range(2):
-                        dataframe["Saturation_"+str(station+1)] = charging_status[station]
-                    if export_df_to_csv:
-                        print("Saving dataframe to csv.")
-                        dataframe.to_csv(path + "dataframe.csv", index=False)
-                
-                    if export_df_to_feather:
-                        print("Saving dataframe to feather.")
-                        dataframe.to_feather(path + "dataframe.feather")
-                
-elif findN: #This allows to understand which is the correct number of N to reach a reasonable half-width
-    while True: 
-        mean_idle_times = [] # List of means
-        # Parameters' setup: This should be coherent with what tried in the isSearch result
-        tugger_train_number = hyper_tugger_train_number[0]
-        tugger_train_capacity = hyper_tugger_train_capacity[0]
-        ul_buffer = hyper_ul_buffer[0]
-        print("Starting the procedure to find N...")
-        print("Testing N:", N)
-        for q in range(N):
-            # print('Simulation run', q)
-            model = FactoryModel(seed=seed)
-            idle_times = [] # Creating a list of idle_times for each run
-            for i in range(int(n_shift*wh*3600)):
-                model.step()  
-                for w in range(5):
-                    idle_times.append(model.schedule_lines.agents[w].idle_time)
-            mean_idle_times.append(statistics.mean(idle_times))
-        s = statistics.variance(mean_idle_times)
-        quantile = scipy.stats.t.ppf(1 - alpha / 2, N - 1)
-        c = quantile * (s / N) ** 0.5
-        if c <= precision*statistics.mean(mean_idle_times):
-            with open("./mean.csv", "w") as f:
-                writer = csv.writer(f)
-                writer.writerow(mean_idle_times) 
-            break
-        else:
-            N = N + 500
-            
+    if config.antithetic:
+        reduction = reduced_variance(runner.results[:N], antithetic=True, alpha=alpha)
+        print("Antithetic pairs: replications needed relative to independent replications:",
+              str(round(reduction.ratio*100, 1)) + "%")
     print("N is " + str(N))
-
-    if (len(hyper_tugger_train_number) + len(hyper_ul_buffer) + len(hyper_tugger_train_capacity)) > 3:
-       print("*****\nWarning: you decided to run the model just for one configuration but you provided more than one "
-               "combination of a parameters. The first combination of parameters was used.\n*****")
-
-
-else:
-    tugger_train_number = hyper_tugger_train_number[0]
-    tugger_train_capacity = hyper_tugger_train_capacity[0]
-    ul_buffer = hyper_ul_buffer[0]
-    model = FactoryModel(seed=seed)
-
-    for i in range(int(n_shift*wh*3600)):  # Seconds
-        model.step()
+    warn_first_configuration(config)
+
+
+def steady_state_kpis(config, cache):
+    # Steady-state KPIs of the first configuration from a single long run, instead of many cold-started
+    # replications: the warm-up is truncated with MSER-5 and the KPIs are estimated with batch means
+    tugger_train_number = config.hyper_tugger_train_number[0]
+    tugger_train_capacity = config.hyper_tugger_train_capacity[0]
+    ul_buffer = config.hyper_ul_buffer[0]
+    n_steps = int(config.steady_state_shifts * config.wh * 3600)
+    print("Simulating", config.steady_state_shifts, "shifts...")
+    series = cache.wrap(functools.partial(kpi_series, tugger_train_number=tugger_train_number,
+                                          tugger_train_capacity=tugger_train_capacity, ul_buffer=ul_buffer,
+                                          n_steps=n_steps, interval=config.observation_interval,
+                                          event_driven=config.event_driven, plant=config.plant(),
+                                          dispatching=config.dispatching))(config.seed)
+    result = steady_state(series, n_batches=config.n_batches, alpha=config.alpha)
+    warm_up = result.warm_up * config.observation_interval
+    print("Warm-up:", u.format_duration(warm_up), "(" + str(round(warm_up / n_steps * 100, 1)) + "% of the run)")
+    if not result.reliable:
+        print("*****\nWarning: the warm-up truncation reached half of the run, which may be too short to reach the "
+              "steady state: increase steady_state_shifts\n*****")
+    batch_length = next(iter(result.kpis.values())).batch_length * config.observation_interval
+    print("Batch means:", config.n_batches, "batches of", u.format_duration(batch_length),
+          "\nConfidence intervals (" + str(int((1 - config.alpha)*100)) + "%):")
+    for name, kpi in result.kpis.items():
+        print("  ", name + ":", round(kpi.mean, 4), "+/-", round(kpi.half_width, 4))
+    print("Idle time per shift of a line [min]:",
+          round(result.kpis["Idle_fraction"].mean * config.wh * 60, 2), "+/-",
+          round(result.kpis["Idle_fraction"].half_width * config.wh * 60, 2))
+    warn_first_configuration(config)
+
+
+def simulate(config, cache):
+    instrumentation = Instrumentation() if config.instrument else None
+    model = FactoryModel.from_config(config, seed=config.seed, instrumentation=instrumentation)
+    tugger_train_number = model.tugger_train_number
+    tugger_train_capacity = model.tugger_train_capacity
+    ul_buffer = model.ul_buffer
+
+    if config.event_driven:
+        model.advance(config.n_steps)
+    else:
+        for i in range(config.n_steps):  # Seconds
+            model.step()
 
     print("\nSYSTEM PERFORMANCES:")
     print("with",
@@ -473,20 +361,63 @@ else:
           "\nTugger train capacity:", tugger_train_capacity,
           "\nUL buffer line(in order):", ul_buffer, end="\n\n")
 
-    for i in range(5):
+    for i, line in enumerate(model.lines):
         print("************\nLINE", i, "\nActual production [UL]:",
-              model.schedule_lines.agents[i].total_production,
-              "\nMaximum production [UL]: ", int(model.system_time/lines_cycle_times[i]),
-              "\nTotal idle time [min]: ", round(model.schedule_lines.agents[i].idle_time/60, 2))
-        if check_model_output:
-            print("\nCheck idle:", round(lines_idle[i][-1]/60, 2))
-            print("Check actual prod:", round(lines_production[i][-1]))
-            print("Total time - Len of prod - Len of prod:", n_shift*wh*3600, len(lines_production[i]), len(lines_idle[i]))
+              line.total_production,
+              "\nMaximum production [UL]: ", int(model.system_time/line.cycle_time),
+              "\nTotal idle time [min]: ", round(line.idle_time/60, 2))
         print("************\n")
-    if (len(hyper_tugger_train_number) + len(hyper_ul_buffer) + len(hyper_tugger_train_capacity)) > 3:
-        print("*****\nWarning: you decided to run the model just for one configuration but you provided more than one "
-              "combination of a parameters. The first combination of parameters was used.\n*****")
-
+    for i, station in enumerate(model.stations):
+        print("CHARGING STATION", i, "\nSaturation [%]:",
+              round(station.saturation_time/model.system_time*100, 2))
+    kpis = model.summary()
+    print("\nTUGGER TRAINS", "\nUtilisation [%]:", round(kpis["Train_utilisation"]*100, 2),
+          "\nEnergy used [kWh]:", round(kpis["Energy_used"], 2),
+          "\nQueue time [min]:", round(kpis["Queue_time"]/60, 2),
+          "\nCharges:", kpis["Charges"])
+    print()
+    if config.instrument:
+        print(instrumentation.summary(), end="\n\n")
+        instrumentation.dump(config.path + "instrumentation.json")
+    warn_first_configuration(config)
+
+
+commands = {"simulate": simulate, "find-n": find_n, "steady-state": steady_state_kpis, "sweep": sweep,
+            "optimise": optimise}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulation of the tugger trains serving the production lines")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for command, function in commands.items():
+        subparser = subparsers.add_parser(command, help=function.__name__.replace("_", " "))
+        subparser.add_argument("scenario", nargs="?", help="TOML or YAML scenario file")
+        subparser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE", type=parse_setting,
+                               help="override a setting of the scenario (repeatable)")
+    benchmark.add_arguments(subparsers.add_parser("bench", help="benchmark on the reference scenarios"))
+    args = parser.parse_args(argv)
+
+    if args.command == "bench":
+        benchmark.main(args)
+        return
+    overrides = dict(args.set)
+    config = Config.from_file(args.scenario, **overrides) if args.scenario else Config(**overrides)
+    # Verbose runs trace every event of the tugger trains to the log file
+    u.configure_logging(config.log_file, "DEBUG" if config.verbose else config.log_level)
+
+    # Cache of replication results, shared by all the procedures and runs
+    cache = ResultCache("./.cache", max_size=config.cache_size * 2**20, enabled=config.use_cache)
+    if config.clear_cache:
+        cache.clear()
+    commands[args.command](config, cache)
+    # Keep the cache within cache_size, removing the least recently used results
+    cache.evict()
+
+
+if __name__ == "__main__":
+    main()
+
+# import matplotlib.pyplot as plt
 # plt.plot(dataframe.Time, dataframe.Saturation_1, label="Stazione 1")
 # plt.plot(dataframe.Time, dataframe.Saturation_2, label="Stazione 2")
 # plt.legend()
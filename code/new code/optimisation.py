@@ -0,0 +1,148 @@
+import itertools
+import math
+from gridsearch import grid_search, job_key
+from replications import RunningStats
+
+
+class Candidate:
+    """
+    Configuration (ul_buffer, tugger_train_number, tugger_train_capacity) raced by racing_search, with its cost and
+    the statistics of the replications performed so far.
+    """
+
+    def __init__(self, ul_buffer, tugger_train_number, tugger_train_capacity, cost):
+        self.ul_buffer = list(ul_buffer)
+        self.tugger_train_number = tugger_train_number
+        self.tugger_train_capacity = tugger_train_capacity
+        self.cost = cost
+        self.stats = RunningStats()
+        # "open", "feasible", "infeasible", "dominated" (not cheaper than a feasible one) or "eliminated" (dropped
+        # by successive halving)
+        self.status = "open"
+
+    def interval(self, alpha):
+        if self.stats.n < 2:
+            return -math.inf, math.inf
+        half_width = self.stats.half_width(alpha)
+        return self.stats.mean - half_width, self.stats.mean + half_width
+
+    def margin(self, target):
+        # Distance of the mean from the target in units of standard error: the larger, the more likely feasible
+        standard_error = (self.stats.variance / self.stats.n) ** 0.5 if self.stats.n > 1 else math.inf
+        if standard_error == 0:
+            return math.inf if self.stats.mean <= target else -math.inf
+        return (target - self.stats.mean) / standard_error
+
+
+def fleet_cost(ul_buffer, tugger_train_number, tugger_train_capacity, tugger_cost=1.0, wagon_cost=0.2,
+               buffer_cost=0.05):
+    """
+    ul_buffer: buffer sizes, tugger_train_number, tugger_train_capacity, *_cost: relative costs of a tugger train,
+    of a wagon (one per unit load of capacity) and of a buffer slot
+
+    Returns the cost of a configuration.
+
+    Return
+    -------
+    float cost
+    """
+    return (tugger_train_number * (tugger_cost + wagon_cost * tugger_train_capacity)
+            + buffer_cost * sum(ul_buffer))
+
+
+def per_line_buffers(buffer_options, n_lines):
+    """
+    buffer_options: buffer sizes allowed for every line, n_lines: lines of the plant
+
+    Returns every combination of per-line buffer sizes.
+
+    Return
+    -------
+    list of buffer lists
+    """
+    return [list(buffers) for buffers in itertools.product(buffer_options, repeat=n_lines)]
+
+
+def max_idle_per_shift(record, n_shift, n_lines):
+    # Response of a replication: idle time per shift [s] of the worst line
+    return max(record["Idle_time_"+str(j+1)] for j in range(n_lines)) / n_shift
+
+
+def racing_search(store, configurations, cost, target, n_shift, seed, n_steps, alpha=0.05, initial_replications=5,
+                  max_replications=80, keep=0.5, n_workers=None, cache=None, plant=None, dispatching="fixed",
+                  common_random_numbers=False, antithetic=False):
+    """
+    store: ResultsStore, configurations: list of (ul_buffer, tugger_train_number, tugger_train_capacity),
+    cost: function of a configuration, target: maximum idle time per shift of every line [s], n_shift: shifts
+    simulated, seed: seed of the search, n_steps: simulated seconds, alpha: significance level of the intervals,
+    initial_replications: replications of the first round, max_replications: replications of the last round,
+    keep: fraction of the open configurations going to the next round, n_workers: processes (None = one per core),
+    cache: ResultCache (optional), plant: config.Plant simulated, dispatching: dispatching policy (see grid_search),
+    common_random_numbers, antithetic: variance reduction of the replications (see gridsearch.run_job)
+
+    Finds a low-cost configuration whose worst line stays idle less than target per shift, treating the model as
+    a noisy black box. Every round runs the replications missing to reach the round size (doubling at each round)
+    for the configurations still open, then:
+    - configurations whose confidence interval lies above target are discarded as infeasible;
+    - configurations whose confidence interval lies below target are feasible, and every configuration not
+      cheaper than the cheapest feasible one is discarded as dominated;
+    - of the remaining ones, only the fraction keep most likely to be feasible goes to the next round.
+    Replications are run with grid_search, so they are saved in the results store and reused by later searches.
+    With antithetic pairs the statistics of the candidates are updated with the averages of the pairs, the
+    independent observations, and the round sizes are rounded up to whole pairs. Common random numbers leave the
+    replications of each candidate independent, and make the comparison of the candidates less noisy.
+
+    Return
+    -------
+    Tuple (cheapest feasible Candidate or None, list of all the candidates, replications run)
+    """
+    candidates = sorted((Candidate(*configuration, cost(*configuration)) for configuration in configurations),
+                        key=lambda candidate: candidate.cost)
+    best = None
+    open_candidates = candidates
+    # Replications averaged into one observation of a candidate
+    group = 2 if antithetic else 1
+    initial_replications += initial_replications % group
+    max_replications += max_replications % group
+    replications = initial_replications
+    replications_run = 0
+    variance_reduction = dict(common_random_numbers=common_random_numbers, antithetic=antithetic)
+    while open_candidates:
+        jobs = [(c.ul_buffer, c.tugger_train_number, c.tugger_train_capacity, r, seed, n_steps)
+                for c in open_candidates for r in range(c.stats.n * group, replications)]
+        missing = [job for job in jobs if job_key(*job, plant=plant, **variance_reduction) not in store]
+        for _ in grid_search(store, missing, n_workers=n_workers, cache=cache, plant=plant,
+                             dispatching=dispatching, **variance_reduction):
+            replications_run += 1
+        for c in open_candidates:
+            for p in range(c.stats.n, replications // group):
+                responses = [max_idle_per_shift(store.records[job_key(c.ul_buffer, c.tugger_train_number,
+                                                                      c.tugger_train_capacity, r, seed, n_steps,
+                                                                      plant=plant, **variance_reduction)],
+                                                n_shift, len(c.ul_buffer))
+                             for r in range(p * group, (p + 1) * group)]
+                c.stats.update(sum(responses) / group)
+
+        for c in open_candidates:
+            lower, upper = c.interval(alpha)
+            if lower > target:
+                c.status = "infeasible"
+            elif upper <= target:
+                c.status = "feasible"
+                if best is None or c.cost < best.cost:
+                    best = c
+        for c in open_candidates:
+            if c.status == "open" and best is not None and c.cost >= best.cost:
+                c.status = "dominated"
+        open_candidates = [c for c in open_candidates if c.status == "open"]
+
+        if replications >= max_replications:
+            break
+        open_candidates.sort(key=lambda c: c.margin(target), reverse=True)
+        n_kept = math.ceil(keep * len(open_candidates))
+        for c in open_candidates[n_kept:]:
+            c.status = "eliminated"
+        open_candidates = open_candidates[:n_kept]
+        replications = min(2 * replications, max_replications)
+        replications += replications % group
+    return best, candidates, replications_run
@@ -0,0 +1,87 @@
+import numpy as np
+
+
+class TraceRecorder:
+    """
+    Collects the evolution of the system during the grid search in preallocated NumPy columns, one per quantity,
+    written in place at each record. The dataframe is built once, at the end, from views of the columns.
+
+    n_rows: maximum number of records (e.g. combinations * simulated seconds / sample_interval)
+    only_changes: skip a record when the state of the system is the same as in the previous record
+    sink: if given (e.g. a ParquetSink), the records are written to the sink every n_rows records and the columns
+          are reused, so that memory use does not depend on the number of records
+    """
+
+    def __init__(self, n_rows: int, n_lines: int = 5, n_stations: int = 2, only_changes=False, sink=None):
+        self.n_rows = n_rows
+        self.n_lines = n_lines
+        self.n_stations = n_stations
+        self.only_changes = only_changes
+        self.sink = sink
+        self.size = 0   # Number of records in the columns
+        self.last_state = None
+
+        self.columns = {"Time": np.empty(n_rows, dtype=np.int32),
+                        "Buffer": np.empty(n_rows, dtype=object),
+                        "Tugger N": np.empty(n_rows, dtype=np.int16),
+                        "Tugger Capacity": np.empty(n_rows, dtype=np.int16),
+                        "Replication": np.empty(n_rows, dtype=np.int16)}
+        for j in range(n_lines):
+            self.columns["Prod_"+str(j+1)] = np.empty(n_rows, dtype=np.int32)
+            self.columns["UL_in_buffer_"+str(j+1)] = np.empty(n_rows, dtype=np.int16)
+            self.columns["Idle_time_"+str(j+1)] = np.empty(n_rows, dtype=np.float32)
+        for station in range(n_stations):
+            self.columns["Saturation_"+str(station+1)] = np.empty(n_rows, dtype=bool)
+
+    def record(self, model, ul_buffer, tugger_train_number, tugger_train_capacity, replication=0):
+        """
+        Writes the current state of model (a FactoryModel) in the next row, together with its hyperparameters and
+        the index of the replication.
+        """
+        lines = model.lines
+        stations = model.stations
+        state = (ul_buffer, tugger_train_number, tugger_train_capacity, replication,
+                 tuple((line.total_production, line.UL_in_buffer, line.idle_time) for line in lines),
+                 tuple(station.is_charging for station in stations))
+        if self.only_changes and state == self.last_state:
+            return
+        self.last_state = state
+
+        if self.size >= self.n_rows:
+            if self.sink is None:
+                raise IndexError("TraceRecorder is full: increase n_rows")
+            self.flush()
+        row = self.size
+        columns = self.columns
+        columns["Time"][row] = model.system_time
+        # The buffer sizes are stored as a label (e.g. "3-3-3-3-3"), usable as a partition value
+        columns["Buffer"][row] = "-".join(str(size) for size in ul_buffer)
+        columns["Tugger N"][row] = tugger_train_number
+        columns["Tugger Capacity"][row] = tugger_train_capacity
+        columns["Replication"][row] = replication
+        for j, line in enumerate(lines):
+            columns["Prod_"+str(j+1)][row] = line.total_production
+            columns["UL_in_buffer_"+str(j+1)][row] = line.UL_in_buffer
+            columns["Idle_time_"+str(j+1)][row] = line.idle_time
+        for station, agent in enumerate(stations):
+            columns["Saturation_"+str(station+1)][row] = agent.is_charging
+        self.size += 1
+
+    def flush(self):
+        """
+        Writes the records in the columns to the sink and empties the columns.
+        """
+        if self.size:
+            self.sink.write({name: column[:self.size] for name, column in self.columns.items()})
+        self.size = 0
+
+    def to_dataframe(self):
+        """
+        Returns the records as a dataframe. The columns of the dataframe are views of the recorder columns.
+
+        Return
+        -------
+        pd.DataFrame
+        """
+        import pandas as pd   # Only needed to export the records
+        return pd.DataFrame({name: column[:self.size] for name, column in self.columns.items()}, copy=False)
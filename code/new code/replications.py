@@ -0,0 +1,287 @@
+import collections
+import multiprocessing
+import os
+import time
+import utils as u
+
+
+class ReplicationRunner:
+    """
+    Runs independent replications of the simulation on a pool of processes.
+
+    simulate is called in the worker processes with the seed of the replication and must return the result of the
+    replication (e.g. simulate_idle_time in factory.py). The seed of replication q is u.spawn_seed(seed, q), so a
+    single replication can be rerun alone passing that seed to FactoryModel. It must be a module-level function, or a functools.partial
+    of one, so that it can be sent to the workers.
+    The results of the replications already performed are kept in self.results (in replication order), so asking for
+    more replications only runs the missing ones.
+    Replications are sent to the workers in chunks of chunksize seeds, with at most two chunks per worker waiting
+    or running, so that a caller stopping early (e.g. sequential_replications) does not leave the workers busy
+    with replications whose results are discarded.
+    With batch_size > 1, every call of simulate runs a whole batch of replications (e.g. simulate_idle_time_batch in
+    batch.py) and must return the list of their results; the seed of batch b is then u.spawn_seed(seed, b).
+    """
+
+    def __init__(self, simulate, seed=None, n_workers=None, chunksize=10, batch_size=1):
+        self.simulate = simulate
+        self.seed = seed
+        self.n_workers = n_workers or os.cpu_count()
+        self.chunksize = chunksize
+        self.batch_size = batch_size
+        self.results = []
+
+    def run(self, n: int):
+        """
+        n:int total number of replications
+
+        Runs the replications from len(self.results) to n - 1 and yields their results as soon as they are
+        available. Stopping the iteration early terminates the workers, keeping the results received so far.
+        When running batches, the last batch may bring self.results beyond n.
+        """
+        first = len(self.results) // self.batch_size
+        seeds = [u.spawn_seed(self.seed, q) for q in range(first, -(-n // self.batch_size))]
+        if not seeds:
+            return
+        if self.n_workers == 1:
+            results = map(self.simulate, seeds)
+            yield from self._collect(results)
+            return
+        with multiprocessing.Pool(min(self.n_workers, len(seeds))) as pool:
+            yield from self._collect(self._submit(pool, seeds))
+
+    def pending(self, n: int):
+        # Replications that run(n) performs (whole batches when running batches)
+        return max(-(-n // self.batch_size) * self.batch_size - len(self.results), 0)
+
+    def _submit(self, pool, seeds):
+        # Results in replication order, so that the output does not depend on scheduling: a new chunk is submitted
+        # each time the oldest one is collected
+        chunks = (seeds[start:start + self.chunksize] for start in range(0, len(seeds), self.chunksize))
+        running = collections.deque()
+        for chunk in chunks:
+            running.append(pool.apply_async(simulate_chunk, (self.simulate, chunk)))
+            if len(running) >= 2 * self.n_workers:
+                yield from running.popleft().get()
+        while running:
+            yield from running.popleft().get()
+
+    def _collect(self, results):
+        for result in results:
+            for replication_result in (result if self.batch_size > 1 else [result]):
+                self.results.append(replication_result)
+                yield replication_result
+
+
+def simulate_chunk(simulate, seeds):
+    # Runs in a worker process: the results of the replications (or batches) of a chunk of seeds
+    return [simulate(seed) for seed in seeds]
+
+
+class RunningStats:
+    """
+    Mean and variance of a sample updated one observation at a time (Welford's algorithm), without keeping the
+    observations in memory.
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0   # Sum of the squared deviations from the mean
+
+    def update(self, x: float):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    @property
+    def variance(self):
+        # Sample variance, as statistics.variance
+        return self.m2 / (self.n - 1) if self.n > 1 else float("nan")
+
+    def half_width(self, alpha: float):
+        """
+        alpha:float significance level
+
+        Returns the half-width of the t-based confidence interval of the mean.
+        """
+        import scipy.stats   # Only needed for the confidence intervals, not by the workers
+        quantile = scipy.stats.t.ppf(1 - alpha / 2, self.n - 1)
+        return float(quantile * (self.variance / self.n) ** 0.5)
+
+
+SequentialResult = collections.namedtuple("SequentialResult", ["n", "mean", "half_width", "ci", "elapsed"])
+
+
+def sequential_replications(runner, alpha: float, precision: float, min_replications=30, max_replications=100000,
+                            check_every=1, progress=None, group=1):
+    """
+    runner: ReplicationRunner, alpha:float significance level, precision:float relative precision,
+    min_replications: observations collected before testing the stopping rule,
+    max_replications: maximum number of replications, check_every: observations between two tests,
+    progress: u.Progress updated after each replication, group: consecutive replications averaged into one
+    observation (2 for antithetic pairs, see factory.simulate_antithetic_pair)
+
+    Runs replications until the half-width of the confidence interval of the mean drops below precision * mean.
+    Mean and variance are updated after each observation, so the procedure stops as soon as the statistics allow
+    it. Replications already stored in the runner are reused.
+
+    Return
+    -------
+    SequentialResult (n replications, mean, half_width, (lower, upper), elapsed time [s])
+    """
+    start = time.perf_counter()
+    stats = RunningStats()
+    pending = []
+
+    def satisfied(replication_result):
+        # Adds the replication to the current group, and tests the stopping rule once the group is complete
+        pending.append(replication_result)
+        if len(pending) < group:
+            return False
+        stats.update(sum(pending) / group)
+        pending.clear()
+        if stats.n < max(min_replications, 2) or stats.n % check_every:
+            return False
+        return stats.half_width(alpha) <= precision * abs(stats.mean)
+
+    for replication_result in runner.results[:max_replications]:
+        if satisfied(replication_result):
+            break
+    else:
+        for replication_result in runner.run(max_replications):
+            if progress is not None:
+                progress.update()
+            if satisfied(replication_result):
+                break
+    half_width = stats.half_width(alpha)
+    return SequentialResult(stats.n * group, stats.mean, half_width, (stats.mean - half_width, stats.mean + half_width),
+                            time.perf_counter() - start)
+
+
+VarianceReduction = collections.namedtuple("VarianceReduction", ["mean", "half_width", "ci", "ratio"])
+
+
+def reduced_variance(observations, baseline=None, antithetic=False, alpha=0.05):
+    """
+    observations: results of the replications of a configuration in replication order, baseline: results of the
+    same replications of another configuration, run with common random numbers (None: estimate the mean of
+    observations alone), antithetic: replications 2p and 2p+1 are an antithetic pair, alpha: significance level
+
+    Estimates the mean of observations (or of their difference from baseline) from independent observations:
+    the replications, or the averages of the antithetic pairs. The variance of the estimate is compared with the
+    one of independent replications of every configuration with the same number of runs, estimated from the
+    variance of the single replications, which common random numbers and antithetic pairs do not change: ratio
+    is the fraction of the replications needed to reach the same confidence interval (e.g. 0.25: four times
+    fewer replications).
+
+    Return
+    -------
+    VarianceReduction (mean, half_width, (lower, upper), ratio)
+    """
+    group = 2 if antithetic else 1
+    n = len(observations) // group
+    if n < 2:
+        raise ValueError("At least 2 independent observations are needed")
+    # Variance of the difference of independent single replications: sum of the variances of the configurations
+    variance = 0.0
+    for series in (observations, baseline):
+        if series is not None:
+            replications = RunningStats()
+            for replication_result in series[:n*group]:
+                replications.update(replication_result)
+            variance += replications.variance
+    stats = RunningStats()
+    for p in range(n):
+        difference = sum(observations[p*group:(p + 1)*group]) / group
+        if baseline is not None:
+            difference -= sum(baseline[p*group:(p + 1)*group]) / group
+        stats.update(difference)
+    half_width = stats.half_width(alpha)
+    return VarianceReduction(stats.mean, half_width, (stats.mean - half_width, stats.mean + half_width),
+                             stats.variance / (variance / group))
+
+
+def mser(observations, batch_size=5):
+    """
+    observations: output series of one long run, batch_size: observations averaged together before truncating
+    (5: MSER-5)
+
+    Chooses the warm-up truncation with the MSER rule: the averages of consecutive batches of batch_size
+    observations are computed, and the first d averages are discarded, d minimising the squared standard error of
+    the mean of the remaining ones (sum of the squared deviations / (m - d)^2, m averages). Only truncations up to
+    half of the series are considered: a minimum at the end of this range means that the run is too short to show
+    the steady state.
+
+    Return
+    -------
+    Tuple (observations to discard, the truncation is reliable)
+    """
+    m = len(observations) // batch_size
+    if m < 4:
+        raise ValueError("MSER needs at least " + str(4 * batch_size) + " observations")
+    averages = [sum(observations[j*batch_size:(j + 1)*batch_size]) / batch_size for j in range(m)]
+    # Statistic of every truncation from the sums of the remaining averages, accumulated from the end
+    statistic = [0.0] * m
+    total = total_squares = 0.0
+    for d in range(m - 1, -1, -1):
+        total += averages[d]
+        total_squares += averages[d] ** 2
+        n = m - d
+        statistic[d] = max(total_squares - total ** 2 / n, 0.0) / n ** 2
+    d = min(range(m // 2 + 1), key=statistic.__getitem__)
+    return d * batch_size, d < m // 2
+
+
+BatchMeansResult = collections.namedtuple("BatchMeansResult", ["mean", "half_width", "ci", "n_batches",
+                                                               "batch_length"])
+
+
+def batch_means(observations, n_batches=20, alpha=0.05):
+    """
+    observations: steady-state output series (warm-up discarded), n_batches: number of batches, alpha: significance
+    level
+
+    Estimates the mean of the series with the method of batch means: the series is split into n_batches contiguous
+    batches of equal length (the observations left over at the beginning are discarded), whose means are nearly
+    independent when the batches are long compared with the correlation of the series, and the confidence
+    interval is the t-based one of the batch means.
+
+    Return
+    -------
+    BatchMeansResult (mean, half_width, (lower, upper), n_batches, batch_length)
+    """
+    batch_length = len(observations) // n_batches
+    if n_batches < 2 or batch_length < 1:
+        raise ValueError("Batch means need at least 2 batches of 1 observation")
+    first = len(observations) - n_batches*batch_length
+    stats = RunningStats()
+    for b in range(n_batches):
+        start = first + b*batch_length
+        stats.update(sum(observations[start:start + batch_length]) / batch_length)
+    half_width = stats.half_width(alpha)
+    return BatchMeansResult(stats.mean, half_width, (stats.mean - half_width, stats.mean + half_width), n_batches,
+                            batch_length)
+
+
+SteadyStateResult = collections.namedtuple("SteadyStateResult", ["warm_up", "reliable", "kpis"])
+
+
+def steady_state(series, n_batches=20, alpha=0.05, batch_size=5):
+    """
+    series: dict KPI name -> output series of one long run (e.g. factory.kpi_series), n_batches, alpha: see
+    batch_means, batch_size: see mser
+
+    Estimates the steady-state value of every KPI from a single long run: the warm-up is truncated at the same
+    point for all the KPIs, the latest of their MSER truncations, and each KPI is then estimated with batch means.
+
+    Return
+    -------
+    SteadyStateResult (observations discarded as warm-up, every truncation is reliable, dict KPI name ->
+    BatchMeansResult)
+    """
+    truncations = [mser(observations, batch_size) for observations in series.values()]
+    warm_up = max(truncation for truncation, _ in truncations)
+    reliable = all(truncation_reliable for _, truncation_reliable in truncations)
+    kpis = {name: batch_means(observations[warm_up:], n_batches, alpha) for name, observations in series.items()}
+    return SteadyStateResult(warm_up, reliable, kpis)
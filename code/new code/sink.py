@@ -0,0 +1,45 @@
+import uuid
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+partition_columns = ["Buffer", "Tugger N", "Tugger Capacity", "Replication"]
+
+
+class ParquetSink:
+    """
+    Writes the records of the grid search to a Parquet dataset while the simulation runs. Every call of write adds
+    one file to each partition, so nothing is kept in memory between two writes.
+    The dataset is partitioned by hyperparameter combination and replication (root/Buffer=.../Tugger N=.../...).
+    """
+
+    def __init__(self, root: str, partition_cols=partition_columns):
+        self.root = root
+        self.partition_cols = partition_cols
+        self.run_id = uuid.uuid4().hex   # Files of different runs never overwrite each other
+        self.n_writes = 0
+
+    def write(self, columns: dict):
+        """
+        columns: dict column name -> NumPy array, all with the same length
+        """
+        table = pa.Table.from_pydict(columns)
+        pq.write_to_dataset(table, self.root, partition_cols=self.partition_cols,
+                            basename_template="part-" + self.run_id + "-" + str(self.n_writes) + "-{i}.parquet",
+                            existing_data_behavior="overwrite_or_ignore")
+        self.n_writes += 1
+
+
+def read_trace(root: str, columns=None, filters=None):
+    """
+    root: path of the dataset, columns: list of columns to be read (all if None),
+    filters: list of (column, operator, value) conditions, e.g. [("Tugger N", "==", 4)]
+
+    Reads back a dataset written by ParquetSink. Only the requested columns are read, and partitions not matching
+    the filters are skipped without being opened.
+
+    Return
+    -------
+    pd.DataFrame
+    """
+    return pd.read_parquet(root, columns=columns, filters=filters)
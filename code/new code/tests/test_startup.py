@@ -0,0 +1,13 @@
+import os
+import sys
+
+# The simulation modules are imported from the folder above, as when main.py is run from it
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+
+
+def test_startup_budgets():
+    # Every module in benchmark.startup_budgets imports within its time budget, in a new interpreter, without
+    # loading the heavy libraries it must not import (see benchmark.check_startup)
+    assert benchmark.check_startup()
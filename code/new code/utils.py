@@ -1,5 +1,9 @@
+import hashlib
+import logging
+import os
 import random
-import pandas as pd
+import sys
+import time
 
 # Parameters
 max_x = 75  # Extreme right point of tugger train path
@@ -9,16 +13,18 @@ def read_line_info(path: str, conversion_factor=60):
     """
     path:str path to the file
     conversion_factor: adjust measure unit
-    Read a file and returns line coordinates, cycle times[min] and weights for each line.
+    Read a file and returns line coordinates, cycle times[min] and weights for each line, and the delay factors of
+    the lines (see max_delay) if the file has a sixth column with them.
 
     Return
     -------
-    Tuple (x, y, cycle times, UL weights)
+    Tuple (x, y, cycle times, UL weights, delay factors or None)
     """
     x = []
     y = []
     cycle_times = []
     weights = []
+    delays = []
 
     with open(path, "r") as f:
         f.seek(0)
@@ -29,7 +35,40 @@ def read_line_info(path: str, conversion_factor=60):
             y.append(float(a[2]))
             cycle_times.append(float(a[3]) * conversion_factor)
             weights.append(float(a[4]))
-    return x, y, cycle_times, weights
+            if len(a) > 5 and a[5].strip():
+                delays.append(float(a[5]))
+    if delays and len(delays) != len(x):
+        raise ValueError("The delay column of " + path + " must be given for every line or for none")
+    return x, y, cycle_times, weights, delays or None
+
+
+def read_nodes(path: str):
+    """
+    path:str path to the file
+    Read a file with a row "kind,x,y" for every warehouse (kind "warehouse") and charging station (kind "station")
+    and returns their coordinates, in the order of the file.
+
+    Return
+    -------
+    Tuple (warehouses as [x, y], stations x, stations y)
+    """
+    warehouses = []
+    stations_x = []
+    stations_y = []
+
+    with open(path, "r") as f:
+        for line in f.readlines()[1:]:
+            if not line.strip():
+                continue
+            kind, x, y = [value.strip() for value in line.split(',')[:3]]
+            if kind == "warehouse":
+                warehouses.append([float(x), float(y)])
+            elif kind == "station":
+                stations_x.append(float(x))
+                stations_y.append(float(y))
+            else:
+                raise ValueError("Unknown kind of node in " + path + ": " + kind)
+    return warehouses, stations_x, stations_y
 
 
 def compute_distance(x1: float, x2: float, y1: float, y2: float, max_x = max_x):
@@ -66,33 +105,42 @@ def compute_speed(weight: float, max_weight: float = 2000):
     return speed
 
 
-def compute_time(distance: float, speed: float, nextline: int = 0, random_flag=True):
+# Maximum random delay [s] per metre travelled of the legs which do not reach a line, and of the lines of a plant
+# whose lines file has no delay column
+base_delay_factor = 0.5
+# Delay factors of the lines of the original plant, whose lines file has no delay column: lines 1, 2 and 4 are the
+# hardest to reach
+original_delay_factors = [0.5, 1.0, 1.0, 0.5, 1.0]
+
+
+def default_delay_factors(n_lines: int):
     """
-    distance:float, speed:float
+    n_lines:int lines of the plant
 
-    Returns the cartesians' movements' time  considering distance [m] to be travelled, speed, and the
-    plane's area which the tugger moves on. The time is computed adding a random
-    delay depending on the final destination and on the distance.
-    Furthermore a fixed amount corresponding to acceleration and decelaration has been added.
-    The function returns time in seconds.
+    Returns the delay factors of a plant whose lines file has no delay column: the ones of the original plant if it
+    has its five lines, base_delay_factor for every line otherwise.
 
     Return
     -------
-    float time [s]
+    list delay factor [s/m] per line
     """
-    # fixed amount for accelerating is taken from LTX_20_T04_50_iGo_EN_TD.pdf page 2, acceleration time for the
-    # truck with the same towing capacity
+    if n_lines == len(original_delay_factors):
+        return list(original_delay_factors)
+    return [base_delay_factor] * n_lines
 
-    if random_flag:
-        if nextline in (1, 2, 4):
-            return distance / speed + random.uniform(0.0, 1.0) * distance + 8
-        else:
-            return distance / speed + random.uniform(0.0, 0.5) * distance + 8
-    else:
-        if nextline in (1, 2, 4):
-            return distance / speed + 8
-        else:
-            return distance / speed + 8
+
+def max_delay(distance: float, delay_factor: float = base_delay_factor):
+    """
+    distance:float, delay_factor: maximum delay per metre travelled of the line the tugger train is heading to
+    (see config.Plant)
+
+    Returns the maximum random delay of a movement (see layout.Layout.travel_time).
+
+    Return
+    -------
+    float delay [s]
+    """
+    return delay_factor * distance
 
 
 def compute_energy(time: float, consumption=2.6):
@@ -124,13 +172,110 @@ def compute_energy_loading(weight: float):
     return energy
 
 
-def progress(percent=0, width=40):
-    left = width * percent // 100
-    right = width - left
-    tags = "=" * left
-    spaces = " " * right
-    percents = f"{percent:.0f}%"
-    print("\r[", tags, spaces, "] ", percents, sep="", end="", flush=True)
+def spawn_seed(seed, *keys):
+    """
+    seed: parent seed, keys: anything identifying the child stream (e.g. replication index, grid point)
+
+    Returns the seed of an independent child random stream. The seed is obtained hashing the parent seed together
+    with the keys, so that the same keys always give the same stream and different keys give unrelated streams.
+
+    Return
+    -------
+    int seed
+    """
+    digest = hashlib.sha256("-".join(str(k) for k in (seed,) + keys).encode()).digest()
+    return int.from_bytes(digest[:8], "big")
+
+
+class AntitheticRandom(random.Random):
+    """
+    Random stream returning 1 - U for every uniform U returned by random.Random with the same seed, so that the
+    draws of uniform (a + (b - a)*U) are mirrored in their range: a replication run with these streams is the
+    antithetic of the one run with random.Random streams and the same seeds.
+    """
+
+    def random(self):
+        return 1.0 - super().random()
+
+
+def format_duration(seconds: float):
+    # h:mm:ss
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+class Progress:
+    """
+    Progress bar redrawn at most every interval seconds, whatever the number of updates, with the throughput and
+    the estimated time left. Updates are counted where the results arrive (e.g. the replications returned by the
+    workers of a pool), so the throughput is the one of all the workers together.
+
+    total: number of units of work (None if not known in advance: only the count and the throughput are shown),
+    unit: name of the unit of work, interval: minimum time between two redraws [s]
+    """
+
+    def __init__(self, total=None, unit="it", interval=0.25, width=40, stream=None):
+        self.total = total
+        self.unit = unit
+        self.interval = interval
+        self.width = width
+        self.stream = stream or sys.stdout
+        self.count = 0
+        self.start = time.perf_counter()
+        self._next_draw = self.start
+        self._length = 0   # Length of the last line drawn, to clear it
+
+    def update(self, n=1):
+        self.count += n
+        now = time.perf_counter()
+        if now >= self._next_draw or self.count == self.total:
+            self._next_draw = now + self.interval
+            self.draw(now)
+
+    def draw(self, now=None):
+        elapsed = (now or time.perf_counter()) - self.start
+        rate = self.count / elapsed if elapsed > 0 else 0.0
+        if self.total:
+            fraction = min(self.count / self.total, 1)
+            left = int(self.width * fraction)
+            eta = format_duration(max(self.total - self.count, 0) / rate) if rate > 0 else "?"
+            line = (f"[{'=' * left}{' ' * (self.width - left)}] {fraction:.0%} {self.count}/{self.total} "
+                    f"{rate:.1f} {self.unit}/s ETA {eta}")
+        else:
+            line = f"{self.count} {self.unit} {rate:.1f} {self.unit}/s elapsed {format_duration(elapsed)}"
+        self.stream.write("\r" + line.ljust(self._length))
+        self.stream.flush()
+        self._length = len(line)
+
+    def close(self):
+        # Draws the final state and ends the line
+        self.draw()
+        self.stream.write("\n")
+        self.stream.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def configure_logging(path=None, level="INFO"):
+    """
+    path: log file (None: standard error), level: minimum level of the records (e.g. "DEBUG" to trace every event
+    of the tugger trains, see FactoryModel verbose)
+
+    Sends the records of the simulation modules to path, as "time level module message" lines. The folder of the
+    file is created now, the file only when the first record is written.
+    """
+    if path:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    handler = logging.FileHandler(path, mode="w", delay=True) if path else logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
 
 
 def read_charging_phases(path: str):
@@ -147,31 +292,6 @@ def read_charging_phases(path: str):
     return charge
 
 
-def compute_charging_time(charge: dict, remaining_energy: float, tot_cap: float):
-    """
-    :param charge: Dictionary with charging stages
-    :param remaining_energy: Remaining energy of the tugger
-    :param tot_cap: Total capacity of the battery
-    :return: Time to reach full charge
-    """
-    percentage = remaining_energy/tot_cap
-    for i in charge.keys():
-        if percentage <= i:
-            max_index = i
-            break
-        if percentage >= i:
-            min_index = i
-
-    upper_time = charge[max_index]
-    lower_time = charge[min_index]
-
-    interpolated_time = lower_time*(max_index - percentage) + upper_time*(percentage - min_index)
-    interpolated_time = interpolated_time/(max_index - min_index)
-    time = charge[1] - upper_time
-    time += interpolated_time
-    return time
-
-
 
 
 